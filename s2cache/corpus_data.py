@@ -227,9 +227,11 @@ class CorpusCache:
         else:
             data = self.maybe_get_data_from_file(ID)
             if data:
-                self.cache[ID] = data[ID].copy()
-                if data and ID in data:
-                    return data[ID]
+                if ID in data:
+                    # Older dumps may store lists; callers do set arithmetic on these
+                    citing = data[ID]
+                    self.cache[ID] = citing if isinstance(citing, set) else set(citing)
+                    return self.cache[ID]
                 else:
                     print(f"Could not find reference data for {ID}")
                     return None
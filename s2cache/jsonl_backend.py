@@ -1,31 +1,178 @@
-from typing import Optional
+from typing import Optional, Iterable
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
+import weakref
+import threading
 from pathlib import Path
-import json
 import logging
 
 from common_pyutil.monitor import Timer
 
 from .models import Pathlike, Metadata, PaperData, IdKeys
-from .util import dump_json, dumps_json, id_to_name
+from .util import dumpb_json, loads_json, load_json_file, id_to_name
 
 
 _timer = Timer()
 
 
+def _replace_file(fpath: Path, data: bytes | Iterable[bytes]):
+    """Atomically replace :code:`fpath` with :code:`data`
+
+    The temporary file ends with :code:`~` so it's never taken as a paper
+    data file. See :attr:`JSONLBackend.files`.
+
+    Args:
+        fpath: Path of the file
+        data: Data to write, or chunks of it
+
+    """
+    tmp = fpath.with_name(fpath.name + "~")
+    with open(tmp, "wb") as f:
+        if isinstance(data, bytes):
+            f.write(data)
+        else:
+            for chunk in data:
+                f.write(chunk)
+    os.replace(tmp, fpath)
+
+
+class _MetadataAppender:
+    """Buffered appends to the metadata file
+
+    The lines are appended :code:`pending_size` at a time with a single
+    :func:`os.write` to the file, which is kept open in append mode.
+
+    Args:
+        fpath: Path of the metadata file
+        pending_size: Number of lines to buffer
+
+    """
+    def __init__(self, fpath: Path, pending_size: int = 64):
+        self.fpath = fpath
+        self.pending: list[bytes] = []
+        self.pending_size = pending_size
+        self.fd: Optional[int] = None
+
+    def append(self, line: bytes):
+        self.pending.append(line)
+        if len(self.pending) >= self.pending_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            if self.fd is None:
+                self.fd = os.open(self.fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self.fd, b"".join(self.pending))
+            self.pending.clear()
+
+    def close(self):
+        self.flush()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class _PaperDataWriter:
+    """Write serialized paper data to files in :code:`root_dir` from a background thread
+
+    The thread is started on the first write. The data pending for an ID is
+    written only once with the latest data, even if it's put again before
+    being written.
+
+    Args:
+        root_dir: Directory of the paper data files
+        logger: Logger for write errors
+
+    """
+    def __init__(self, root_dir: Path, logger: logging.Logger):
+        self.root_dir = root_dir
+        self.logger = logger
+        self.pending: dict[str, bytes] = {}
+        self.queue: queue.Queue[Optional[str]] = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def put(self, ID: str, payload: bytes):
+        with self.lock:
+            # An ID already pending is still in the queue
+            queued = ID in self.pending
+            self.pending[ID] = payload
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="s2cache-writer",
+                                               daemon=True)
+                self.thread.start()
+        if not queued:
+            self.queue.put(ID)
+
+    def get(self, ID: str) -> Optional[bytes]:
+        with self.lock:
+            return self.pending.get(ID)
+
+    def _run(self):
+        while True:
+            ID = self.queue.get()
+            if ID is None:
+                self.queue.task_done()
+                return
+            try:
+                payload = self.get(ID)
+                if payload is not None:
+                    _replace_file(self.root_dir.joinpath(ID), payload)
+                    with self.lock:
+                        if self.pending.get(ID) is payload:
+                            del self.pending[ID]
+                        else:
+                            # Updated while being written
+                            self.queue.put(ID)
+            except Exception as e:
+                self.logger.error(f"Could not write data for {ID}: {e}")
+                with self.lock:
+                    self.pending.pop(ID, None)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait till all the pending data is written"""
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self):
+        """Write the pending data and stop the thread"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
 class JSONLBackend:
     def __init__(self, root_dir: Pathlike, logger_name: str):
         self._root_dir = Path(root_dir)
-        self._files: list[str] = [*filter(
-            lambda x: not x.endswith("~") and "metadata" not in x and x != "cache"
-            and "duplicates" not in x,
-            os.listdir(self._root_dir))]
         self._logger = logging.getLogger(logger_name)
+        self._metadata_appender = _MetadataAppender(self.metadata_file)
+        self._paper_writer = _PaperDataWriter(self._root_dir, self._logger)
+        # Pending writes are finished when the backend is collected or at
+        # exit, without keeping the backend alive till then
+        weakref.finalize(self, self._metadata_appender.close)
+        weakref.finalize(self, self._paper_writer.close)
 
     @property
     def logger(self):
         return self._logger
 
+    @property
+    def files(self):
+        """Names of the paper data files in the cache directory
+
+        The directory is scanned lazily each time this is iterated. Directories
+        are skipped using the entry type from the scan itself.
+
+        """
+        return (entry.name for entry in os.scandir(self._root_dir)
+                if not entry.name.endswith("~") and "metadata" not in entry.name
+                and entry.name != "cache" and "duplicates" not in entry.name
+                and entry.is_file())
+
     @property
     def duplicates_file(self):
         return self._root_dir.joinpath("duplicates.csv")
@@ -53,12 +200,12 @@ class JSONLBackend:
 
         """
         metadata: Metadata = {}
+        self.flush_metadata()
         if self.metadata_file.exists():
-            with open(self.metadata_file) as f:
-                lines = f.read().split("\n")
-            for line in lines:
-                if line:
-                    metadata.update(json.loads(line))
+            with open(self.metadata_file, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        metadata.update(loads_json(line))
             self.logger.debug(f"Loaded metadata from {self.metadata_file}")
         else:
             self.logger.warning("Metadata file not found. Intialzing empty metadata")
@@ -98,16 +245,47 @@ class JSONLBackend:
             # f.write(dumps_json({paper_id: duplicates}))
         self.logger.debug(f"Updated duplicate in JSONL backend for {paper_id}")
 
+    def flush_metadata(self):
+        """Append the pending metadata updates to the metadata file
+
+        """
+        self._metadata_appender.flush()
+
+    def close_metadata_file(self):
+        """Flush pending updates and close the append handle to the metadata file if it's open
+
+        """
+        self._metadata_appender.close()
+
+    def _metadata_chunks(self, metadata, chunk_size: int = 1 << 20):
+        """Serialize :code:`metadata` as JSON lines in chunks of about :code:`chunk_size` bytes
+
+        Args:
+            metadata: Metadata to serialize
+            chunk_size: Minimum size of each chunk except the last
+
+        """
+        lines: list[bytes] = []
+        size = 0
+        for k, v in metadata.items():
+            line = dumpb_json({k: v}) + b"\n"
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield b"".join(lines)
+                lines.clear()
+                size = 0
+        if lines:
+            yield b"".join(lines)
+
     def dump_jsonl_metadata(self, metadata):
         """Dump JSON lines metadata to disk.
 
         This will be default from version :code:`0.2.0`
 
         """
-        with open(self.metadata_file, "w") as f:
-            for k, v in metadata.items():
-                f.write(dumps_json({k: v}))
-                f.write("\n")
+        self.close_metadata_file()
+        _replace_file(self.metadata_file, self._metadata_chunks(metadata))
         self.logger.debug("Dumped metadata")
 
     def update_jsonl_metadata_on_disk(self, paper_id: str, data: dict):
@@ -116,11 +294,13 @@ class JSONLBackend:
         Args:
             paper_id: The paper id to update
 
+        The updates are buffered and appended a few at a time to the metadata
+        file, which is kept open in append mode. Pending updates are flushed
+        at exit, on :meth:`close_metadata_file` and before the metadata is
+        loaded.
 
         """
-        with open(self.metadata_file, "a") as f:
-            f.write("\n")
-            f.write(dumps_json({paper_id: data}))
+        self._metadata_appender.append(b"\n" + dumpb_json({paper_id: data}))
         self.logger.debug(f"Updated metadata for {paper_id}")
 
     def dump_paper_data(self, ID: str, data: PaperData, force: bool = False):
@@ -132,14 +312,26 @@ class JSONLBackend:
 
         The data is stored as JSON. This function handles it as raw :class:`dict`
 
+        The data is serialized here and written by a background thread to a
+        temporary file which then replaces the existing one, so that the
+        caller doesn't wait on the disk and a failed write doesn't corrupt it.
+        Until it's written, :meth:`get_paper_data` returns the pending data.
+        See :meth:`flush_paper_data`
+
         """
-        fpath = self._root_dir.joinpath(str(ID))
+        ID = str(ID)
         if len(data.citations.data) > data.details.citationCount:
             data.details.citationCount = len(data.citations.data)
         with _timer:
-            with open(fpath, "w") as f:
-                dump_json(data, f)
-        self.logger.debug(f"Wrote file {fpath} in {_timer.time} seconds")
+            payload = dumpb_json(data)
+        self._paper_writer.put(ID, payload)
+        self.logger.debug(f"Serialized data for {ID} in {_timer.time} seconds")
+
+    def flush_paper_data(self):
+        """Wait till all the pending paper data is written to disk
+
+        """
+        self._paper_writer.flush()
 
     def get_paper_data(self, ID: str, quiet: bool = False) -> Optional[dict]:
         """Fetch S2 details from disk with SSID=ID
@@ -147,20 +339,34 @@ class JSONLBackend:
         Args:
             ID: SSID of the paper
 
+        The file is opened without checking that it exists first, so that a
+        lookup costs a single syscall whether the data is there or not. Files
+        written by other processes sharing the cache directory are found.
+
         """
-        data_file = self._root_dir.joinpath(ID)
-        if data_file.exists():
-            if not quiet:
-                self.logger.debug(f"Data for {ID} is on disk")
-            with open(data_file, "rb") as f:
-                data = f.read()
-            return json.loads(data)  # type: ignore
-        else:
+        payload = self._paper_writer.get(ID)
+        if payload is not None:
+            return loads_json(payload)
+        try:
+            data = load_json_file(self._root_dir.joinpath(ID))
+        except FileNotFoundError:
             return None
+        if not quiet:
+            self.logger.debug(f"Data for {ID} is on disk")
+        return data
+
+    def _load_file(self, fname: str) -> tuple[str, dict]:
+        return fname, load_json_file(self._root_dir.joinpath(fname))
 
     def rebuild_jsonl_metadata(self):
         """Rebuild the JSON lines metadata file in case it's corrupted
+
+        The files are read and parsed in a thread pool and the metadata is
+        written serially.
+
         """
+        self.close_metadata_file()
+        self.flush_paper_data()
         id_names_map = {"arxivid": "ARXIV",
                         "arxiv": "ARXIV",
                         "doi": "DOI",
@@ -170,10 +376,10 @@ class JSONLBackend:
                         "aclid": "ACL",
                         "dblp": "DBLP",
                         "acl": "ACL"}
-        with open(self.metadata_file, "w") as wf:
-            for fname in self._files:
-                with open(self._root_dir.joinpath(fname)) as f:
-                    paper_data = json.load(f)
+        tmp = self.metadata_file.with_name(self.metadata_file.name + "~")
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+        with open(tmp, "wb") as wf, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for fname, paper_data in executor.map(self._load_file, self.files):
                 details = paper_data["details"] if "details" in paper_data else paper_data
                 if "externalIds" in details:
                     ext_ids = {id_to_name(k): v
@@ -181,7 +387,8 @@ class JSONLBackend:
                 else:
                     ext_ids = {id_names_map[k.lower()]: details[k] for k in details
                                if k.lower() in id_names_map}
-                    ext_ids = {k: ext_ids[k] if k in ext_ids else ""
-                               for k in IdKeys}
-                wf.write(dumps_json({fname: ext_ids}))
-                wf.write("\n")
+                    get_id = ext_ids.get
+                    ext_ids = {k: get_id(k, "") for k in IdKeys}
+                wf.write(dumpb_json({fname: ext_ids}))
+                wf.write(b"\n")
+        os.replace(tmp, self.metadata_file)
@@ -42,9 +42,7 @@ IdNames = {
     "DBLP": IdTypes.dblp,
 }
 
-IdKeys = [x for x in IdNames.keys() if "corpus" not in x.lower() or x == "SS"]
-IdKeys.append("CorpusId")
-IdKeys.sort()
+IdKeys = tuple(sorted(IdNames.keys()))
 
 
 @dataclass
@@ -216,7 +214,7 @@ class PaperData:
 
 
 def _maybe_fix_citation_data(citation_data):
-    if isinstance(citation_data.data[0], dict):
+    if citation_data.data and isinstance(citation_data.data[0], dict):
         data = []
         for x in citation_data.data:
             try:
@@ -13,13 +13,18 @@ A paper lookup can be performed by giving the ID and the type of ID.
 
 """
 
-from typing import Optional, Callable, Any, cast
+from typing import Optional, Callable, Any, Iterable, cast
+from functools import lru_cache
+from itertools import islice
+from collections import OrderedDict
 import re
-import json
 import math
 import time
+import atexit
 import random
 import logging
+import threading
+import weakref
 from pathlib import Path
 import asyncio
 import dataclasses
@@ -28,6 +33,11 @@ import yaml
 import aiohttp
 from common_pyutil.monitor import Timer
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 from .models import (Pathlike, Metadata, Config, SubConfig, PaperDetails,
                      Citation, Citations, PaperData, Error, _maybe_fix_citation_data,
                      IdTypes, IdNames, IdKeys)
@@ -35,36 +45,157 @@ from .filters import (year_filter, author_filter, num_citing_filter,
                       num_influential_count_filter, venue_filter, title_filter)
 from .corpus_data import CorpusCache
 from .config import default_config, load_config
-from .util import id_to_name
+from .util import id_to_name, dumps_json, dumpb_json, loads_json, load_json_file
 from .jsonl_backend import JSONLBackend
 from .sqlite_backend import SQLiteBackend
 
 
 _timer = Timer()
+_non_alnum_re = re.compile(r"[^a-z0-9]+", flags=re.IGNORECASE)
+_paper_data_keys = frozenset(x.name for x in dataclasses.fields(PaperData))
+# Fields of the citations and references endpoints which belong to the
+# citation and not to the citing or cited paper
+_citation_fields = frozenset(["contexts", "contextsWithIntent", "intents", "isInfluential"])
+# Clients whose state is dumped at exit. See :meth:`SemanticScholar.load_client_state`
+_clients: "weakref.WeakSet[SemanticScholar]" = weakref.WeakSet()
+
+
+def _dump_clients_state():
+    for client in list(_clients):
+        client.dump_client_state()
+
+
+atexit.register(_dump_clients_state)
+
+
+def _recent_timestamps(ttl: float, size: int, *entries: dict) -> OrderedDict[int, float]:
+    """Merge :code:`entries` of ids and the times they were added
+
+    The latest time is kept for each id. Entries older than :code:`ttl`
+    seconds are dropped and at most :code:`size` of the most recent are
+    kept, oldest first.
+
+    Args:
+        ttl: Time to live in seconds
+        size: Maximum number of entries
+        entries: :class:`dict` of ids and times
+
+    """
+    now = time.time()
+    merged: dict[int, float] = {}
+    for entry in entries:
+        for k, v in entry.items():
+            k, v = int(k), float(v)
+            if now - v <= ttl and v > merged.get(k, 0):
+                merged[k] = v
+    return OrderedDict(sorted(merged.items(), key=lambda x: x[1])[-size:])
 
 
-def get_corpus_id(data: Citation | PaperDetails) -> int:
+def get_corpus_id(data: Citation | PaperDetails | dict) -> int:
     """Get :code:`corpusId` field from :class:`Citation` or :class:`PaperDetails`
 
+    Citations and paper details as stored on the backend, i.e. :class:`dict`
+    are also accepted. :code:`-1` is returned if there's no :code:`corpusId`.
+
     Args:
         data: PaperDetails or Citation data
 
 
     """
-    if hasattr(data, "externalIds"):
-        if data.externalIds:
-            cid = data.externalIds["CorpusId"]
-            return int(cid)
-    elif hasattr(data, "citingPaper"):
-        if data.citingPaper["externalIds"]:  # type: ignore
-            cid = data.citingPaper.externalIds["CorpusId"]
-            return int(cid)
-    return -1
+    if isinstance(data, Citation):
+        data = data.citingPaper
+    elif isinstance(data, dict):
+        data = data.get("citingPaper", data)
+    ext_ids = data.get("externalIds") if isinstance(data, dict) else data.externalIds
+    cid = ext_ids.get("CorpusId") if ext_ids else None
+    if not cid:
+        return -1
+    return cid if type(cid) is int else int(cid)
+
+
+def _citations_index(citations: Citations) -> tuple[set[str], set[int]]:
+    """Return :code:`paperId` and :code:`corpusId` sets of the citing papers
+
+    The sets are built in a single pass and kept on :code:`citations` as
+    a (non field) attribute so that repeated membership checks don't walk the
+    data again. They're rebuilt if the data has changed in size and
+    :meth:`SemanticScholar._update_citations` updates them with the data.
+
+    Args:
+        citations: Citations data
+
+
+    """
+    index = getattr(citations, "_index", None)
+    if index is not None and index[0] == len(citations.data):
+        return index[1], index[2]
+    paper_ids: set[str] = set()
+    corpus_ids: set[int] = set()
+    for x in citations.data:
+        paper = x.citingPaper if isinstance(x, Citation) else x.get("citingPaper", {})
+        if "paperId" in paper:
+            paper_ids.add(paper["paperId"])
+        cid = get_corpus_id(paper)
+        if cid != -1:
+            corpus_ids.add(cid)
+    citations._index = (len(citations.data), paper_ids, corpus_ids)  # type: ignore
+    return paper_ids, corpus_ids
+
+
+def _citations_corpus_ids(data: PaperData) -> set[int]:
+    return _citations_index(data.citations)[1]
+
 
+class _EventLoop:
+    """Event loop on which the requests of a client are made, with its client session
 
-def _citations_corpus_ids(data: PaperData) -> list[int]:
-    return [int(x["citingPaper"]["externalIds"]["CorpusId"])
-            for x in data["citations"]["data"]]
+    The loop is created on first use and runs forever in a daemon thread, so
+    that it persists across the synchronous calls. It's kept apart from the
+    client so that it can be closed when the client is collected, without
+    the client being kept alive for it.
+
+    A :mod:`uvloop` loop is used if it's installed. The global event loop
+    policy is left untouched.
+
+    """
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    def get(self) -> asyncio.AbstractEventLoop:
+        """Return the loop, starting it if it isn't running"""
+        with self.lock:
+            if self.loop is None:
+                self.loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever,
+                                               name="s2cache-loop", daemon=True)
+                self.thread.start()
+        return self.loop
+
+    async def _aclose(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.semaphore = None
+
+    def close(self):
+        """Close the client session and stop the loop"""
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop, self.thread = None, None
+        if loop is None:
+            return
+        if threading.current_thread() is thread:
+            # Closed from a callback on the loop itself, so it can't be waited on
+            loop.create_task(self._aclose()).add_done_callback(lambda _: loop.stop())
+            return
+        asyncio.run_coroutine_threadsafe(self._aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()  # type: ignore
+        loop.close()
 
 
 class SemanticScholar:
@@ -102,6 +233,15 @@ class SemanticScholar:
 
     """
 
+    _filters: dict[str, Callable] = {"year": year_filter,
+                                     "author": author_filter,
+                                     "num_citing": num_citing_filter,
+                                     "citationcount": num_citing_filter,
+                                     "influential_count": num_influential_count_filter,
+                                     "influentialcitationcount": num_influential_count_filter,
+                                     "venue": venue_filter,
+                                     "title": title_filter}
+
     @property
     def filters(self) -> dict[str, Callable]:
         """Allowed filters on the entries.
@@ -109,15 +249,7 @@ class SemanticScholar:
         ["year", "author", "num_citing", "influential_count", "venue", "title"]
 
         """
-        _filters: dict[str, Callable] = {"year": year_filter,
-                                         "author": author_filter,
-                                         "num_citing": num_citing_filter,
-                                         "citationcount": num_citing_filter,
-                                         "influential_count": num_influential_count_filter,
-                                         "influentialcitationcount": num_influential_count_filter,
-                                         "venue": venue_filter,
-                                         "title": title_filter}
-        return _filters
+        return self._filters
 
     def __init__(self, *,
                  cache_dir: Optional[Pathlike] = None,
@@ -161,6 +293,7 @@ class SemanticScholar:
         self.initialize_backend()
         self.load_metadata()
         self.load_duplicates_metadata()
+        self.load_client_state()
         self.maybe_load_corpus_cache()
 
     def _init_some_vars(self):
@@ -171,14 +304,84 @@ class SemanticScholar:
         self._root_url = "https://api.semanticscholar.org/graph/v1"
         self._batch_size = self.config.batch_size
         self._tolerance = 10
-        self._dont_build_citations: set = set()
+        self._max_retries = 5
+        self._backoff_base = 0.5
+        self._backoff_cap = 30
+        # Maximum number of ids the paper batch endpoint accepts
+        self._paper_batch_size = 500
+        # Corpus ids for which citations were already built, with the time
+        # they were built, oldest first. The oldest are evicted when it's
+        # full. It's kept across runs, see :meth:`load_client_state`
+        self._dont_build_citations: OrderedDict[int, float] = OrderedDict()
+        self._dont_build_citations_size = 10000
+        self._dont_build_citations_ttl = 7 * 24 * 60 * 60
+        # Corpus ids which the API couldn't find, with the time they were
+        # last not found, oldest first. Bounded like the above
+        self._missing_corpus_ids: OrderedDict[int, float] = OrderedDict()
+        self._missing_corpus_ids_size = 100000
+        self._missing_corpus_ids_ttl = 7 * 24 * 60 * 60
+        # Number of entries evaluated and rejected by each filter
+        self._filter_stats: dict[str, tuple[int, int]] = {}
+        # LRU of ETags of citation pages for conditional requests and the
+        # response bodies to reuse when unchanged, bounded by the total size
+        # of the bodies. See :meth:`_add_etag`
+        self._etags: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+        self._etags_bytes = 0
+        self._etags_max_bytes = 32 * 1024 * 1024
         self._client_timeout = self._client_timeout or self.config.client_timeout
         self._cache_backend_name = self._cache_backend_name or self.config.cache_backend
         self._aio_timeout = aiohttp.ClientTimeout(self._client_timeout)
+        # The loop and session are closed when the client is collected or at
+        # exit, if :meth:`close` isn't called before
+        self._event_loop = _EventLoop()
+        weakref.finalize(self, self._event_loop.close)
+        self._init_required_fields()
+        self._init_fields_strings()
         self._metadata: Metadata = {}
         self._extid_metadata: Metadata = {}
         self._duplicates: dict[str, str] = {}
 
+    def _init_required_fields(self):
+        """Precompute the sets of fields which cached data must have
+
+        Fields like :code:`contexts` and :code:`intents` belong to the citation
+        and not to the paper, so the ones in the config are checked separately.
+
+        """
+        self._required_fields = {"details": frozenset(self.config.details.fields)}
+        self._required_citation_fields: dict[str, frozenset[str]] = {}
+        for key in ["citations", "references"]:
+            fields = frozenset(self.config[key].fields)
+            self._required_fields[key] = fields - _citation_fields
+            self._required_citation_fields[key] = fields & _citation_fields
+
+    def _init_fields_strings(self):
+        """Precompute the comma separated :code:`fields` arguments and templates of the API URLs
+
+        """
+        self._fields_strings = {key: ",".join(self.config[key].fields)
+                                for key in ["search", "details", "citations", "references",
+                                            "author", "author_papers"]}
+        # Paper details for citations fetched individually. The citation
+        # fields are not available in paper details
+        self._fields_strings["citing_paper"] = ",".join(
+            x for x in self.config.citations.fields if x not in _citation_fields)
+        # URL templates with everything except the ids (and the limits which
+        # can be given per call) filled in
+        root, fields, config = self._root_url, self._fields_strings, self.config
+        self._url_templates = {
+            "details": f"{root}/paper/{{ID}}?fields={fields['details']}",
+            "citations": f"{root}/paper/{{ID}}/citations?fields={fields['citations']}"
+            "&limit={limit}",
+            "references": f"{root}/paper/{{ID}}/references?fields={fields['references']}"
+            "&limit={limit}",
+            "author": f"{root}/author/{{ID}}?fields={fields['author']}"
+            f"&limit={config.author.limit}",
+            "author_papers": f"{root}/author/{{ID}}/papers?fields={fields['author_papers']}"
+            f"&limit={config.author_papers.limit}",
+            "search": f"{root}/paper/search?query={{terms}}&fields={fields['search']}"
+            f"&limit={config.search.limit}"}
+
     def _init_cache(self):
         """Initialize the cache from :code:`cache_dir`
 
@@ -193,7 +396,6 @@ class SemanticScholar:
         else:
             self._cache_dir = Path(_cache_dir)
         self._in_memory: dict[str, PaperData] = {}
-        self._rev_cache: dict[str, list[str]] = {}
 
     def initialize_backend(self):
         if self._cache_backend_name == "jsonl":
@@ -207,11 +409,17 @@ class SemanticScholar:
         self._metadata = self._cache_backend.load_metadata()
         if self._metadata:
             ext_ids = [*next(iter(self._metadata.values())).keys()]
-            self._extid_metadata = {k: {} for k in ext_ids}
+            # The id types in metadata are already stored as names. See
+            # :func:`util.id_to_name`
+            extid_metadata: Metadata = {k: {} for k in ext_ids}
+            get_ids = extid_metadata.get
             for paper_id, extids in self._metadata.items():
                 for idtype, ID in extids.items():
-                    if ID and id_to_name(idtype) in self._extid_metadata:
-                        self._extid_metadata[idtype][ID] = paper_id
+                    if ID:
+                        ids = get_ids(idtype)
+                        if ids is not None:
+                            ids[ID] = paper_id
+            self._extid_metadata = extid_metadata
         else:
             self._extid_metadata = {k: {} for k in IdKeys if k.lower() != "ss"}
 
@@ -234,6 +442,74 @@ class SemanticScholar:
         if ID not in self._duplicates:
             self._cache_backend.update_duplicates_metadata(ID, self._duplicates[ID])
 
+    @property
+    def client_state_file(self) -> Path:
+        """File in :attr:`cache_dir` where the client state is kept across runs"""
+        return self._cache_dir.joinpath("client_state_metadata.json")
+
+    def load_client_state(self):
+        """Load the client state from :attr:`client_state_file`
+
+        The state is the corpus ids for which citations were already built
+        from the :attr:`corpus_cache`, the corpus ids not found by the API
+        and the filter statistics. Corpus ids older than their TTL, i.e.
+        :code:`_dont_build_citations_ttl` and :code:`_missing_corpus_ids_ttl`
+        are dropped. The state is dumped again at exit, as long as the
+        client is alive.
+
+        """
+        state = self._read_client_state()
+        self._dont_build_citations = _recent_timestamps(
+            self._dont_build_citations_ttl, self._dont_build_citations_size,
+            state.get("dont_build_citations", {}))
+        self._missing_corpus_ids = _recent_timestamps(
+            self._missing_corpus_ids_ttl, self._missing_corpus_ids_size,
+            state.get("missing_corpus_ids", {}))
+        self._filter_stats = {k: (int(v[0]), int(v[1]))
+                              for k, v in state.get("filter_stats", {}).items()}
+        _clients.add(self)
+
+    def _read_client_state(self) -> dict:
+        if self.client_state_file.exists():
+            try:
+                return load_json_file(self.client_state_file)
+            except ValueError:
+                self.logger.warning(f"Could not parse {self.client_state_file}. Ignoring")
+        return {}
+
+    def dump_client_state(self):
+        """Dump the client state to :attr:`client_state_file`
+
+        Other clients may share the :attr:`cache_dir`, so the state is merged
+        with the one on disk. The latest time is kept for each corpus id and
+        the statistics over the most entries for each filter.
+
+        See :meth:`load_client_state`
+
+        """
+        if not (self._dont_build_citations or self._missing_corpus_ids or self._filter_stats):
+            return
+        state = self._read_client_state()
+        built = _recent_timestamps(self._dont_build_citations_ttl,
+                                   self._dont_build_citations_size,
+                                   state.get("dont_build_citations", {}),
+                                   self._dont_build_citations)
+        filter_stats = {k: (int(v[0]), int(v[1]))
+                        for k, v in state.get("filter_stats", {}).items()}
+        for k, v in self._filter_stats.items():
+            if v[0] >= filter_stats.get(k, (0, 0))[0]:
+                filter_stats[k] = v
+        missing = _recent_timestamps(self._missing_corpus_ids_ttl,
+                                     self._missing_corpus_ids_size,
+                                     state.get("missing_corpus_ids", {}),
+                                     self._missing_corpus_ids)
+        state = {"dont_build_citations": built,
+                 "missing_corpus_ids": missing,
+                 "filter_stats": filter_stats}
+        tmp_file = self.client_state_file.with_name(self.client_state_file.name + "~")
+        tmp_file.write_bytes(dumpb_json(state))
+        tmp_file.replace(self.client_state_file)
+
     @property
     def client_timeout(self) -> int:
         """Timeout for the client."""
@@ -250,9 +526,18 @@ class SemanticScholar:
 
         See :class:`models.Config`
 
+        The fields derived from the config are recomputed when it's set. If
+        the fields in the config are changed in place, set it again.
+
         """
         return self._config
 
+    @config.setter
+    def config(self, x: Config):
+        self._config = x
+        self._init_required_fields()
+        self._init_fields_strings()
+
     @property
     def batch_size(self) -> int:
         """Batch size for fetching urls in batches
@@ -331,13 +616,21 @@ class SemanticScholar:
         """
         _maybe_fix_citation_data(existing_citation_data)
         _maybe_fix_citation_data(new_citation_data)
-        new_data_ids = {x.citingPaper["paperId"]  # type: ignore
-                        for x in new_citation_data.data}
+        # The index of new_citation_data is updated along with the data
+        new_data_ids, new_corpus_ids = _citations_index(new_citation_data)
+        data = new_citation_data.data
         for x in existing_citation_data.data:
-            if x.citingPaper["paperId"] not in new_data_ids:  # type: ignore
-                new_citation_data.data.append(x)
+            paper = x.citingPaper
+            paper_id = paper["paperId"]  # type: ignore
+            if paper_id not in new_data_ids:
+                data.append(x)
+                new_data_ids.add(paper_id)
+                corpus_id = get_corpus_id(paper)
+                if corpus_id != -1:
+                    new_corpus_ids.add(corpus_id)
                 if new_citation_data.next:
                     new_citation_data.next += 1
+        new_citation_data._index = (len(data), new_data_ids, new_corpus_ids)  # type: ignore
         return new_citation_data
 
     def _check_duplicate(self, ID) -> tuple[str, str | None]:
@@ -383,11 +676,12 @@ class SemanticScholar:
             if existing_data is not None:
                 self._update_citations(existing_data.citations, data.citations)
         self.store_paper_data(paper_id, data, force=force)
-        for k, v in details.externalIds.items():
-            if id_to_name(k) in self._extid_metadata and str(v):
-                self._extid_metadata[id_to_name(k)][str(v)] = paper_id
-        self._metadata[paper_id] = {id_to_name(k): str(v)
-                                    for k, v in details.externalIds.items()}
+        ext_ids = {id_to_name(k): str(v) for k, v in details.externalIds.items()}
+        extid_metadata = self._extid_metadata
+        for k, v in ext_ids.items():
+            if v and k in extid_metadata:
+                extid_metadata[k][v] = paper_id
+        self._metadata[paper_id] = ext_ids
         self.update_paper_metadata(paper_id)
         if ID != paper_id:
             self.update_duplicates_metadata(ID)
@@ -403,11 +697,15 @@ class SemanticScholar:
         Args:
             data: data for the paper
 
+        The details are copied shallowly and the citing and cited papers are
+        not copied.
+
         """
-        _data = PaperData(**dataclasses.asdict(data))
-        _data.details.references = [x["citedPaper"] for x in _data.references.data]  # type: ignore
-        _data.details.citations = [x["citingPaper"] for x in _data.citations.data]  # type: ignore
-        return _data.details
+        return dataclasses.replace(
+            data.details,
+            references=[x["citedPaper"] for x in data.references.data],  # type: ignore
+            citations=[x.citingPaper if isinstance(x, Citation) else x["citingPaper"]  # type: ignore
+                       for x in data.citations.data])
 
     def details_url(self, ID: str) -> str:
         """Return the paper url for a given `ID`
@@ -416,8 +714,7 @@ class SemanticScholar:
             ID: paper identifier
 
         """
-        fields = ",".join(self.config.details.fields)
-        return f"{self._root_url}/paper/{ID}?fields={fields}"
+        return self._url_templates["details"].format(ID=ID)
 
     def citations_url(self, ID: str, num: int = 0, offset: Optional[int] = None) -> str:
         """Generate the citations url for a given `ID`
@@ -428,9 +725,8 @@ class SemanticScholar:
             offset: offset from where to fetch in the url
 
         """
-        fields = ",".join(self.config.citations.fields)
         limit = num or self.config.citations.limit
-        url = f"{self._root_url}/paper/{ID}/citations?fields={fields}&limit={limit}"
+        url = self._url_templates["citations"].format(ID=ID, limit=limit)
         if offset is not None:
             return url + f"&offset={offset}"
         else:
@@ -444,9 +740,73 @@ class SemanticScholar:
             num: number of citations to fetch in the url
 
         """
-        fields = ",".join(self.config.references.fields)
         limit = num or self.config.references.limit
-        return f"{self._root_url}/paper/{ID}/references?fields={fields}&limit={limit}"
+        return self._url_templates["references"].format(ID=ID, limit=limit)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the event loop on which all the requests are made
+
+        See :class:`_EventLoop`
+
+        """
+        return self._event_loop.get()
+
+    def _run(self, coro):
+        """Run a coroutine on the persistent event loop and wait for the result
+
+        Args:
+            coro: The coroutine to run
+
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def _arun(self, coro) -> asyncio.Future:
+        """Run a coroutine on the persistent event loop and return an awaitable for it
+
+        This lets the async methods be awaited from any event loop, while the
+        requests themselves are made on the loop the client session belongs to.
+
+        Args:
+            coro: The coroutine to run
+
+        """
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._get_loop()))
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the client session shared by all the requests
+
+        The session is created on first use on the persistent event loop and
+        is reused afterwards, so that the connections to the API are kept alive
+        across calls.
+
+        """
+        event_loop = self._event_loop
+        if event_loop.session is None or event_loop.session.closed:
+            event_loop.session = self._client_session(self._aio_timeout)
+        return event_loop.session
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Return the semaphore which bounds the requests in flight to :attr:`batch_size`
+
+        It's created on first use on the persistent event loop.
+
+        """
+        event_loop = self._event_loop
+        if event_loop.semaphore is None:
+            event_loop.semaphore = asyncio.Semaphore(self.batch_size)
+        return event_loop.semaphore
+
+    def close(self):
+        """Close the client session and stop the event loop
+
+        """
+        self._event_loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def _get(self, url: str):
         """Synchronously get a URL with the API key if present.
@@ -455,43 +815,190 @@ class SemanticScholar:
             url: URL
 
         """
-        result = asyncio.run(self._get_some_urls([url]))
+        result = self._run(self._get_some_urls([url]))
         return result[0]
 
-    async def _aget(self, session: aiohttp.ClientSession, url: str) -> dict:
+    def _client_session(self, timeout: aiohttp.ClientTimeout) -> aiohttp.ClientSession:
+        """Create an :class:`aiohttp.ClientSession` for the API
+
+        All the requests go through the same session and its connection
+        pool. The number of connections is capped at :attr:`batch_size`, idle
+        connections are kept alive and DNS lookups for the API host are cached.
+
+        The headers and timeout are given with each request as they can change
+        after the session is created.
+
+        Args:
+            timeout: Default client timeout for the session
+
+        """
+        connector = aiohttp.TCPConnector(limit=self.batch_size, ttl_dns_cache=300,
+                                         keepalive_timeout=60)
+        return aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+    def _backoff_time(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Time to wait before retrying a request
+
+        Args:
+            attempt: The number of the attempt which failed, starting from 0
+            retry_after: Value of the :code:`Retry-After` header, if any
+
+        """
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return min(self._backoff_cap, self._backoff_base * 2 ** attempt) + random.random()
+
+    async def _arequest(self, session: aiohttp.ClientSession, method: str, url: str,
+                        timeout: Optional[aiohttp.ClientTimeout] = None,
+                        conditional: bool = False,
+                        headers: Optional[dict[str, str]] = None, **kwargs):
+        """Asynchronously request a url and parse the response as JSON.
+
+        Args:
+            sesssion: An :class:`aiohttp.ClientSession` instance
+            method: HTTP method
+            url: The url to fetch
+            timeout: Optional timeout for the request
+            conditional: Whether to make a conditional request with the
+                         :code:`ETag` of the last response for the :code:`url`
+            headers: Headers in addition to :attr:`headers`
+            kwargs: Additional arguments for :meth:`aiohttp.ClientSession.request`
+
+        At most :attr:`batch_size` requests are in flight at any time.
+
+        Rate limited (429) and server error responses, connection errors and
+        timeouts are retried upto :code:`self._max_retries` times with
+        exponential backoff and jitter, or after the time in the
+        :code:`Retry-After` header if given. If the retries run out, or the
+        response isn't JSON, an :code:`{"error": ...}` entry is returned.
+        Timeouts on the last attempt are raised.
+
+        For a :code:`conditional` request, the body of a response with an
+        :code:`ETag` is kept and if the response is unchanged (304) the kept
+        body is parsed and returned instead. This saves the transfer of the
+        body but not its parsing. See :meth:`_add_etag`
+
+        """
+        headers = {**self.headers, **headers} if headers else self.headers
+        # NOTE: The entry is held here as it may be evicted before the response
+        kept = self._etags.get(url) if conditional else None
+        if kept is not None:
+            headers = {**headers, "If-None-Match": kept[0]}
+        sem = self._get_semaphore()
+        for attempt in range(self._max_retries):
+            last_attempt = attempt == self._max_retries - 1
+            retry_after = None
+            try:
+                # NOTE: The semaphore is held only during an attempt and not
+                #       while waiting to retry
+                async with sem:
+                    resp = await session.request(method, url=url, headers=headers,
+                                                 timeout=timeout or self._aio_timeout,
+                                                 **kwargs)
+                    if kept is not None and resp.status == 304:
+                        resp.release()
+                        if url in self._etags:
+                            self._etags.move_to_end(url)
+                        return loads_json(kept[1])
+                    if resp.status != 429 and resp.status < 500:
+                        # NOTE: Parse the raw bytes instead of resp.json() so that the body
+                        #       isn't also held as a decoded str while parsing
+                        body = await resp.read()
+                        try:
+                            result = loads_json(body)
+                        except ValueError:
+                            return {"error": f"Could not parse response with status "
+                                    f"{resp.status} for {url}"}
+                        if conditional and resp.status == 200 and "ETag" in resp.headers:
+                            self._add_etag(url, resp.headers["ETag"], body)
+                        return result
+                    retry_after = resp.headers.get("Retry-After")
+                    resp.release()
+                    if last_attempt:
+                        return {"error": f"Got status {resp.status} for {url} "
+                                f"after {self._max_retries} attempts"}
+            except asyncio.exceptions.TimeoutError:
+                if last_attempt:
+                    raise
+            except aiohttp.ClientError as e:
+                if last_attempt:
+                    return {"error": f"Could not fetch {url} after "
+                            f"{self._max_retries} attempts: {e}"}
+            wait_time = self._backoff_time(attempt, retry_after)
+            self.logger.debug(f"Retrying {url} in {wait_time:.2f} seconds")
+            await asyncio.sleep(wait_time)
+        return {}
+
+    def _add_etag(self, url: str, etag: str, body: bytes):
+        """Store the :code:`etag` and response :code:`body` for :code:`url`
+
+        The bodies are kept as raw bytes and the least recently used ones are
+        evicted once their total size is over :code:`_etags_max_bytes`, so
+        that's the most memory the kept pages take. Bodies larger than that
+        aren't kept.
+
+        Args:
+            url: The url
+            etag: Value of the :code:`ETag` header of its response
+            body: Raw body of the response
+
+        """
+        old = self._etags.pop(url, None)
+        if old is not None:
+            self._etags_bytes -= len(old[1])
+        if len(body) > self._etags_max_bytes:
+            return
+        self._etags[url] = (etag, body)
+        self._etags_bytes += len(body)
+        while self._etags_bytes > self._etags_max_bytes:
+            self._etags_bytes -= len(self._etags.popitem(last=False)[1][1])
+
+    async def _aget(self, session: aiohttp.ClientSession, url: str,
+                    timeout: Optional[aiohttp.ClientTimeout] = None,
+                    conditional: bool = False) -> dict:
         """Asynchronously get a url.
 
         Args:
             sesssion: An :class:`aiohttp.ClientSession` instance
             url: The url to fetch
+            timeout: Optional timeout for the request
+            conditional: Whether to make a conditional request
+
+        See :meth:`_arequest` for retries and conditional requests.
 
         """
-        resp = await session.request('GET', url=url)
-        data = await resp.json()
-        return data
+        return await self._arequest(session, "GET", url, timeout, conditional)
 
-    async def _get_some_urls(self, urls: list[str], timeout: Optional[int] = None) -> list:
+    async def _get_some_urls(self, urls: list[str], timeout: Optional[int] = None,
+                             conditional: bool = False) -> list:
         """Get some URLs asynchronously
 
         Args:
             urls: list of URLs
+            timeout: Optional timeout for each request
+            conditional: Whether to make conditional requests. See :meth:`_arequest`
 
         URLs are fetched with :class:`aiohttp.ClientSession` with api_key included
         The results parsed as JSON, stored in a list and returned.
 
+        At most :attr:`batch_size` requests are in flight, see :meth:`_arequest`.
+        A request which still times out after retries gives an error entry
+        in its place.
+
         """
         if timeout is None:
             timeout = self._aio_timeout  # type: ignore
         else:
             timeout = aiohttp.ClientTimeout(timeout)  # type: ignore
-        try:
-            async with aiohttp.ClientSession(headers=self.headers,
-                                             timeout=timeout) as session:
-                tasks = [self._aget(session, url) for url in urls]
-                results = await asyncio.gather(*tasks)
-        except asyncio.exceptions.TimeoutError:
-            return []
-        return results
+        session = await self._get_session()
+
+        async def get(url: str):
+            try:
+                return await self._aget(session, url, timeout, conditional)  # type: ignore
+            except asyncio.exceptions.TimeoutError:
+                return {"error": f"Timed out fetching {url}"}
+
+        return await asyncio.gather(*map(get, urls))
 
     def _post(self, url: str, data):
         """Synchronously get a URL with the API key if present.
@@ -500,20 +1007,27 @@ class SemanticScholar:
             url: URL
 
         """
-        result = asyncio.run(self._post_some_urls([url], [data]))
+        result = self._run(self._post_some_urls([url], [data]))
         return result[0]
 
-    async def _apost(self, session: aiohttp.ClientSession, url: str, data) -> dict:
-        """Asynchronously get a url.
+    async def _apost(self, session: aiohttp.ClientSession, url: str, data,
+                     timeout: Optional[aiohttp.ClientTimeout] = None) -> dict:
+        """Asynchronously post :code:`data` as JSON to a url.
 
         Args:
             sesssion: An :class:`aiohttp.ClientSession` instance
-            url: The url to fetch
+            url: The url to post to
+            data: JSON serializable data
+            timeout: Optional timeout for the request
+
+        See :meth:`_arequest` for retries.
 
         """
-        resp = await session.request('POST', url=url, json=dumps_json(data))
-        data = await resp.json()
-        return data
+        # NOTE: Serialize with dumpb_json instead of json= so that orjson is used
+        #       when available
+        return await self._arequest(session, "POST", url, timeout,
+                                    headers={"Content-Type": "application/json"},
+                                    data=dumpb_json(data))
 
     async def _post_some_urls(self, urls: list[str], data: list, timeout: Optional[int] = None) -> list:
         """Get some URLs asynchronously
@@ -523,19 +1037,23 @@ class SemanticScholar:
 
         URLs are fetched with :class:`aiohttp.ClientSession` with api_key included
 
+        Like :meth:`_get_some_urls` requests are bounded and a timeout gives an
+        error entry.
+
         """
         if timeout is None:
             timeout = self._aio_timeout  # type: ignore
         else:
             timeout = aiohttp.ClientTimeout(timeout)  # type: ignore
-        try:
-            async with aiohttp.ClientSession(headers=self.headers,
-                                             timeout=timeout) as session:
-                tasks = [self._apost(session, url, _data) for url, _data in zip(urls, data)]
-                results = await asyncio.gather(*tasks)
-        except asyncio.exceptions.TimeoutError:
-            return []
-        return results
+        session = await self._get_session()
+
+        async def post(url: str, _data):
+            try:
+                return await self._apost(session, url, _data, timeout)  # type: ignore
+            except asyncio.exceptions.TimeoutError:
+                return {"error": f"Timed out posting to {url}"}
+
+        return await asyncio.gather(*map(post, urls, data))
 
     async def _paper(self, ID: str) -> dict:
         """Asynchronously fetch paper details, references and citations.
@@ -574,7 +1092,39 @@ class SemanticScholar:
 
         """
         ID, duplicate_id = self._check_duplicate(ID)
-        result = asyncio.run(self._paper(ID))
+        result = self._run(self._paper(ID))
+        return self._store_details(ID, duplicate_id, result, quiet, force)
+
+    async def astore_details_and_get(
+            self, ID: str,
+            quiet: bool = False,
+            force: bool = False) -> Error | PaperData:
+        """Like :meth:`store_details_and_get` but can be awaited.
+
+        Many papers can be fetched concurrently by gathering the calls.
+
+        Args:
+            ID: paper identifier
+            quiet: Don't log debug messages
+            force: Force update the data on backend
+
+        """
+        ID, duplicate_id = self._check_duplicate(ID)
+        result = await self._arun(self._paper(ID))
+        return self._store_details(ID, duplicate_id, result, quiet, force)
+
+    def _store_details(self, ID: str, duplicate_id: Optional[str], result: dict,
+                       quiet: bool, force: bool) -> Error | PaperData:
+        """Parse and store the :code:`result` of :meth:`_paper` and return the data
+
+        Args:
+            ID: paper identifier
+            duplicate_id: The ID of which :code:`ID` is a duplicate if any
+            result: Fetched details, references and citations
+            quiet: Don't log debug messages
+            force: Force update the data on backend
+
+        """
         try:
             data = PaperData(**result)
         except TypeError:
@@ -583,8 +1133,7 @@ class SemanticScholar:
             ID, data, quiet=quiet, force=force)
         if maybe_error:
             return maybe_error
-        ID = data.details.paperId
-        data = self._in_memory[ID]
+        # data is the same object which is now in self._in_memory
         data.details.duplicateId = duplicate_id
         return data
 
@@ -602,10 +1151,11 @@ class SemanticScholar:
                           behaviour is to return paper details
 
         """
+        data: PaperData | Error | None
         if have_metadata:
-            self.logger.debug(f"Checking for cached data for {ID}")
-            data: PaperData | Error | None = self._check_cache(ID)
             if not force:
+                self.logger.debug(f"Checking for cached data for {ID}")
+                data = self._check_cache(ID)
                 if data is None:
                     self.logger.debug(f"PaperDetails for {ID} stale or not present on backend. Will fetch.")
                     data = self.store_details_and_get(ID, quiet=True, force=True)
@@ -620,6 +1170,29 @@ class SemanticScholar:
         else:
             return self.to_details(data)
 
+    def _lookup_ssid(self, id_type: str, ID: str) -> Error | tuple[str, bool]:
+        """Look up the paper ID for :code:`ID` of type :code:`id_type` in the metadata
+
+        Return the paper ID and :code:`True` if it's in the metadata. Otherwise
+        return the ID as :code:`id_name:ID` with which it can be fetched from
+        the API and :code:`False`.
+
+        Args:
+            id_type: Type of ID
+            ID: The ID
+
+        """
+        ID = str(ID)
+        id_name = id_to_name(id_type)
+        id_enum = IdNames.get(id_name)
+        if id_enum is None:
+            return Error(message="INVALID ID TYPE")
+        elif id_enum == IdTypes.ss:
+            return ID, ID in self._metadata
+        else:
+            ssid = self._extid_metadata.get(id_name, {}).get(ID, "")
+            return (ssid, True) if ssid else (f"{id_name}:{ID}", False)
+
     def id_to_corpus_id(self, id_type: str, ID: str) ->\
             Error | str:
         """Fetch :code:`CorpusId` for a given paper ID of type :code:`id_type`
@@ -632,21 +1205,17 @@ class SemanticScholar:
         external services.
 
         """
-        ID = str(ID)
-        if id_to_name(id_type) not in IdTypes:
-            return Error(message="INVALID ID TYPE")
-        else:
-            id_name = id_to_name(id_type)
-            ssid = self._extid_metadata[id_name].get(ID, "")
-            have_metadata = bool(ssid)
+        lookup = self._lookup_ssid(id_type, ID)
+        if isinstance(lookup, Error):
+            return lookup
+        ssid, have_metadata = lookup
         if have_metadata:
             return self._metadata[ssid]["CorpusId"]
-        data = self.fetch_from_cache_or_api(
-            False, f"{id_name}:{ID}", False, False)
+        data = self.fetch_from_cache_or_api(False, ssid, False, no_transform=True)
         if isinstance(data, Error):
             return data
-        data = cast(PaperDetails, data)
-        return str(data.externalIds["CorpusId"])
+        data = cast(PaperData, data)
+        return str(data.details.externalIds["CorpusId"])
 
     def get_details_for_id(self, id_type: str, ID: str, force: bool, paper_data: bool)\
             -> Error | PaperData | PaperDetails:
@@ -665,18 +1234,12 @@ class SemanticScholar:
             paper_data: Get PaperData instead of PaperDetails.
 
         """
-        ID = str(ID)
-        if id_to_name(id_type) not in IdNames:
-            return Error(message="INVALID ID TYPE")
-        elif IdNames[id_to_name(id_type)] == IdTypes.ss:
-            ssid = ID
-            have_metadata = ssid in self._metadata
-        else:
-            id_name = id_to_name(id_type)
-            ssid = self._extid_metadata[id_name].get(ID, "")
-            have_metadata = bool(ssid)
+        lookup = self._lookup_ssid(id_type, ID)
+        if isinstance(lookup, Error):
+            return lookup
+        ssid, have_metadata = lookup
         data = self.fetch_from_cache_or_api(
-            have_metadata, ssid or f"{id_name}:{ID}", force, no_transform=paper_data)
+            have_metadata, ssid, force, no_transform=paper_data)
         if paper_data or isinstance(data, Error):
             return data
         else:
@@ -721,14 +1284,68 @@ class SemanticScholar:
         Limits are defined in configuration
 
         """
-        if data.citations:
-            limit = self.config.citations.limit
+        limit = self.config.citations.limit
+        if len(data.citations) > limit:
             data.citations = data.citations[:limit]
-        if data.references:
-            limit = self.config.references.limit
+        limit = self.config.references.limit
+        if len(data.references) > limit:
             data.references = data.references[:limit]
         return data
 
+    def _validate_fields(self, data: dict) -> bool:
+        """Check if the paper :code:`data` has all the fields in :attr:`config`
+
+        Only the first entry of citations and references is checked as they
+        are all fetched with the same fields.
+
+        Args:
+            data: Paper data as stored on the backend
+
+        """
+        if not data.keys() >= _paper_data_keys:
+            return False
+        if not self._required_fields["details"] <= data["details"].keys():
+            return False
+        for key, paper_key in [("citations", "citingPaper"), ("references", "citedPaper")]:
+            entries = data[key].get("data")
+            if entries:
+                entry = entries[0]
+                if not self._required_citation_fields[key] <= entry.keys():
+                    return False
+                if not self._required_fields[key] <= entry.get(paper_key, {}).keys():
+                    return False
+        return True
+
+    def _load_in_memory(self, ID: str, data: Optional[dict], quiet: bool = False) -> bool:
+        """Parse paper :code:`data` read from the backend and store it in memory
+
+        Return :code:`True` if the data was valid and is now in memory.
+
+        Args:
+            ID: Paper ID
+            data: Paper data as read from the backend
+            quiet: Don't log stale data if True
+
+        """
+        if not data:
+            self.logger.debug(f"Tried to load data for {ID} from backend but could not")
+            return False
+        # The cheap field checks are done before constructing the dataclasses
+        # so that stale data isn't parsed at all. TypeError can still be raised
+        # for fields which aren't in the models.
+        paper_data = None
+        if self._validate_fields(data):
+            try:
+                paper_data = PaperData(**data)
+            except TypeError:
+                pass
+        if paper_data is None:
+            if not quiet:
+                self.logger.debug(f"Stale data for {ID}")
+            return False
+        self._in_memory[ID] = paper_data
+        return True
+
     def _check_cache(self, ID: str, quiet: bool = False) -> Optional[PaperData]:
         """Check cache and return data for ID if found.
 
@@ -742,17 +1359,7 @@ class SemanticScholar:
         if ID not in self._in_memory:
             if not quiet:
                 self.logger.debug(f"Data for {ID} not in memory")
-            data = self.get_paper_data(ID, quiet=quiet)
-            if data:
-                try:
-                    paper_data = PaperData(**data)
-                    self._in_memory[ID] = paper_data
-                except TypeError:
-                    if not quiet:
-                        self.logger.debug(f"Stale data for {ID}")
-                    return None
-            else:
-                self.logger.debug(f"Tried to load data for {ID} from backend but could not")
+            if not self._load_in_memory(ID, self.get_paper_data(ID, quiet=quiet), quiet):
                 return None
         else:
             self.logger.debug(f"Data for {ID} in memory")
@@ -823,7 +1430,7 @@ class SemanticScholar:
             if offset+limit > 10000 and self.corpus_cache is not None:
                 corpus_id = data.details.externalIds["CorpusId"]
                 if corpus_id:
-                    citations = self._build_citations_from_stored_data(
+                    citations, _ = self._build_citations_from_stored_data(
                         corpus_id=corpus_id,
                         existing_ids=_citations_corpus_ids(data),
                         cite_count=cite_count,
@@ -845,7 +1452,7 @@ class SemanticScholar:
             self.store_paper_data(paper_id, data)
             return data.citations
 
-    def _batch_urls(self, n: int, url_prefix: str):
+    def _batch_urls(self, n: int, url_prefix: str) -> list[str]:
         """Generate a list of urls in batch size of :attr:`batch_size`
 
         Args:
@@ -857,15 +1464,26 @@ class SemanticScholar:
         parts remaining.
 
         """
-        urls = []
-        batch_size = self.batch_size
-        offset = 0
+        return [f"{url_prefix}&limit={limit}&offset={offset}"
+                for limit, offset in self._batch_limits(n, self.batch_size)]
+
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _batch_limits(n: int, batch_size: int) -> tuple[tuple[int, int], ...]:
+        """The :code:`limit` and :code:`offset` of each batch for :code:`n` entries
+
+        They don't depend on the paper, so they're cached for all the papers.
+
+        Args:
+            n: number of entries
+            batch_size: number of entries in each batch
+
+        """
         iters = min(10, math.ceil(n / batch_size))
-        for i in range(iters):
-            limit = 9999 - (offset + i * batch_size)\
-                if (offset + i * batch_size) + batch_size > 10000 else batch_size
-            urls.append(f"{url_prefix}&limit={limit}&offset={offset + i * batch_size}")
-        return urls
+        offsets = range(0, iters * batch_size, batch_size)
+        # The API serves at most 10000 entries, so clamp to offset + limit <= 10000
+        limits = [min(batch_size, 10000 - offset) for offset in offsets]
+        return tuple((limit, offset) for limit, offset in zip(limits, offsets) if limit > 0)
 
     def _ensure_all_citations(self, ID: str) -> Citations:
         """Fetch all citations for a given paper_id :code:`ID`
@@ -888,73 +1506,113 @@ class SemanticScholar:
                 self.logger.warning("More than 10000 citations cannot be fetched "
                                     "with this function. Use next_citations for that. "
                                     "Will only get first 10000")
-            fields = ",".join(self.config.citations.fields)
+            fields = self._fields_strings["citations"]
             url_prefix = f"{self._root_url}/paper/{ID}/citations?fields={fields}"
             urls = self._batch_urls(cite_count - existing_cite_count, url_prefix)
             self.logger.debug(f"Will fetch {len(urls)} requests for citations")
             self.logger.debug(f"All urls {urls}")
             with _timer:
-                results = asyncio.run(self._get_some_urls(urls))
+                # Pages unchanged since they were last fetched are served
+                # from the kept response bodies
+                results = self._run(self._get_some_urls(urls, conditional=True))
             self.logger.debug(f"Got {len(results)} results")
-            citations: Citations = Citations(next=0, offset=0, data=[])
-            cite_list = []
+            # Single pass over the results for data, errors and next offset
+            cite_list: list[Citation] = []
             errors = 0
+            next_val = 10000
+            all_have_next = True
             for x in results:
-                if "error" not in x:
-                    cite_list.extend([Citation(**e) for e in x["data"]])
-                else:
+                if "next" not in x:
+                    all_have_next = False
+                if "error" in x:
                     errors += 1
-            citations.data = cite_list
+                    continue
+                cite_list.extend(Citation(**e) for e in x["data"])
+                if "next" in x and x["next"] > next_val:
+                    next_val = x["next"]
             self.logger.debug(f"Have {len(cite_list)} citations without errors")
             if errors:
                 self.logger.debug(f"{errors} errors occured while fetching all citations for {ID}")
-            if all("next" in x for x in results):
-                citations.next = max([*[x["next"] for x in results if "error" not in x], 10000])
-            else:
-                citations.next = None
-            return citations
+            return Citations(offset=0, data=cite_list,
+                             next=next_val if all_have_next else None)
         else:
             msg = f"Paper data for {ID} should already exist"
             raise ValueError(msg)
 
-    def _get_some_urls_in_batches(self, urls: list[str]) -> list[dict]:
-        """Fetch :attr:`batch_size` examples at a time to prevent overloading the service
+    async def _iter_paper_batches(self, ids: list[str], fields: str):
+        """Fetch paper details for :code:`ids` with the paper batch endpoint
+
+        The ids are posted :attr:`_paper_batch_size` at a time. Each batch is
+        yielded along with its response as it completes, so they're not in
+        the order of :code:`ids`. A successful response has an entry for each
+        id in the batch, in the same order.
 
         Args:
-            urls: URLs to fetch
+            ids: Paper IDs in any of the formats accepted by the API
+            fields: Comma separated fields to fetch
 
         """
-        batch_size = self.batch_size
-        j = 0
-        _urls = urls[j*batch_size:(j+1)*batch_size]
-        results = []
-        _results = []
-        while _urls:
-            self.logger.debug(f"Fetching for j {j} out of {len(urls)//batch_size} urls")
-            with _timer:
-                _results = asyncio.run(self._get_some_urls(_urls, 5))
-                while not _results:
-                    wait_time = random.randint(1, 5)
-                    self.logger.debug(f"Got empty results. Waiting {wait_time}")
-                    time.sleep(wait_time)
-                    _results = asyncio.run(self._get_some_urls(_urls))
-            results.extend(_results)
-            j += 1
-            _urls = urls[j*batch_size:(j+1)*batch_size]
-        return results
+        url = f"{self._root_url}/paper/batch?fields={fields}"
+        session = await self._get_session()
+        size = self._paper_batch_size
+
+        async def post(batch: list[str]):
+            try:
+                return batch, await self._apost(session, url, {"ids": batch})
+            except asyncio.exceptions.TimeoutError:
+                return batch, {"error": f"Timed out fetching {len(batch)} papers"}
+
+        batches = [ids[i:i+size] for i in range(0, len(ids), size)]
+        for task in asyncio.as_completed([post(x) for x in batches]):
+            yield await task
+
+    async def _get_citing_papers(self, corpus_ids: Iterable[int]) -> tuple[list[Citation], int]:
+        """Fetch paper details for :code:`corpus_ids` as :class:`Citation` entries
+
+        Each response is wrapped as it arrives. Return the entries and the
+        number of papers which couldn't be fetched because of errors. Papers
+        not found are skipped. The ids not found are remembered in
+        :attr:`_missing_corpus_ids` and aren't requested again till they expire.
+
+        Args:
+            corpus_ids: Semantic Scholar CorpusIds
+
+        """
+        missing, ttl, now = self._missing_corpus_ids, self._missing_corpus_ids_ttl, time.time()
+        ids = [f"CorpusID:{x}" for x in corpus_ids if now - missing.get(x, 0) > ttl]
+        # Remove the citation fields as they're not available in paper details
+        fields = self._fields_strings["citing_paper"]
+        data = []
+        errors = 0
+        async for batch, result in self._iter_paper_batches(ids, fields):
+            if isinstance(result, list):
+                for ID, x in zip(batch, result):
+                    if x is None:
+                        self._add_missing_corpus_id(int(ID[len("CorpusID:"):]))
+                    elif isinstance(x, dict) and "error" not in x:
+                        data.append(Citation(citingPaper=x, contexts=[]))
+                    else:
+                        errors += 1
+            else:
+                self.logger.debug(f"Error fetching paper batch {result}")
+                errors += len(batch)
+        return data, errors
 
     # TODO: Need to add condition such that if num_citations > 10000, then this
     #       function is called. And also perhaps, fetch first 1000 citations and
     #       update the stored data (if they're sorted by time)
     def _build_citations_from_stored_data(self,
                                           corpus_id: int | str,
-                                          existing_ids: list[int],
+                                          existing_ids: set[int] | list[int],
                                           cite_count: int,
                                           *,
                                           offset: int = 0,
-                                          limit: int = 0) -> Optional[Citations]:
+                                          limit: int = 0) -> tuple[Optional[Citations], int]:
         """Build the citations data for a paper entry from cached data
 
+        Return the citations and the number of papers which couldn't be
+        fetched because of errors.
+
         Args:
             corpus_id: Semantic Scholar CorpusId
             existing_ids: Existing ids present if any
@@ -966,29 +1624,28 @@ class SemanticScholar:
             refs_ids = self.corpus_cache.get_citations(int(corpus_id))
             if not refs_ids:
                 raise AttributeError(f"Not found for {corpus_id}")
-            fetchable_ids = list(refs_ids - set(existing_ids))
+            if not isinstance(existing_ids, set):
+                existing_ids = set(existing_ids)
+            fetchable = refs_ids.difference(existing_ids)
             if not limit:
-                limit = len(fetchable_ids)
-            cite_gap = cite_count - len(fetchable_ids) - len(existing_ids)
+                limit = len(fetchable)
+            cite_gap = cite_count - len(fetchable) - len(existing_ids)
             if cite_gap:
                 self.logger.warning(f"{cite_gap} citations cannot be fetched. "
                                     "You have stale SS data")
-            fetchable_ids = fetchable_ids[offset:offset+limit]
-            # Remove contexts as that's not available in paper details
-            fields = ",".join(self.config.citations.fields).replace(",contexts", "")
-            urls = [f"{self._root_url}/paper/CorpusID:{ID}?fields={fields}"
-                    for ID in fetchable_ids]
-            citations = Citations(offset=0, data=[])
-            result = self._get_some_urls_in_batches(urls)
-            for x in result:
-                try:
-                    citations.data.append(Citation(**{"citingPaper": x, "contexts": []}))  # type: ignore
-                except Exception:
-                    pass        # ignore errors
-            return citations          # type: ignore
+            # Only materialize the ids which will be fetched
+            fetchable_ids = list(islice(fetchable, offset, offset+limit))
+            self.logger.debug(f"Fetching {len(fetchable_ids)} papers "
+                              f"{self._paper_batch_size} per request")
+            with _timer:
+                data, errors = self._run(self._get_citing_papers(fetchable_ids))
+            self.logger.debug(f"Fetched {len(data)} papers in {_timer.time} seconds")
+            if errors:
+                self.logger.warning(f"Could not fetch {errors} papers for {corpus_id}")
+            return Citations(offset=0, data=data), errors
         else:
             self.logger.error("References Cache not present")
-            return None
+            return None, 0
 
     def _maybe_fetch_citations_greater_than_10000(self, existing_data: PaperData):
         """Fetch citations when their number is > 10000.
@@ -1003,36 +1660,82 @@ class SemanticScholar:
         if self.corpus_cache is None:
             return None
         cite_count = len(existing_data.citations.data)
-        existing_corpus_ids = [get_corpus_id(x) for x in existing_data.citations.data]
-        if -1 in existing_corpus_ids:
-            existing_corpus_ids.remove(-1)
-        corpus_id = get_corpus_id(existing_data["details"])  # type: ignore
-        if not corpus_id:
-            raise AttributeError("Did not expect corpus_id to be 0")
-        if corpus_id not in self._dont_build_citations:
-            more_data = self._build_citations_from_stored_data(corpus_id,
-                                                               existing_corpus_ids,
-                                                               cite_count)
-            new_ids = set([x.citingPaper["paperId"] for x in more_data.data  # type: ignore
-                           if "paperId" in x.citingPaper])                   # type: ignore
-            # NOTE: Some debug vars commented out
-            # new_data_dict = {x["citingPaper"]["paperId"]: x["citingPaper"]
-            #                  for x in more_data["data"]
-            #                  if "citingPaper" in x and "error" not in x["citingPaper"]
-            #                  and "paperId" in x["citingPaper"]}
-            # existing_citation_dict = {x["citingPaper"]["paperId"]: x["citingPaper"]
-            #                           for x in existing_data["citations"]["data"]}
-
-            existing_ids = set(x.citingPaper["paperId"]  # type: ignore
-                               for x in existing_data.citations.data)
-            something_new = new_ids - existing_ids
-            if more_data and more_data.data and something_new:
+        existing_ids, existing_corpus_ids = _citations_index(existing_data.citations)
+        corpus_id = get_corpus_id(existing_data.details)
+        if corpus_id == -1:
+            raise AttributeError("Did not expect corpus_id to be missing")
+        update = False
+        if not self._citations_recently_built(corpus_id):
+            more_data, errors = self._build_citations_from_stored_data(corpus_id,
+                                                                       existing_corpus_ids,
+                                                                       cite_count)
+            if more_data and more_data.data:
                 self.logger.debug(f"Fetched {len(more_data.data)} in {_timer.time} seconds")
-                existing_data.citations = self._update_citations(more_data, existing_data.citations)
-                update = True
-        self._dont_build_citations.add(corpus_id)
+                # Merge in a single pass, keeping the citations index current
+                if existing_data.citations.data:
+                    _maybe_fix_citation_data(existing_data.citations)
+                cite_data = existing_data.citations.data
+                for x in more_data.data:
+                    paper_id = x.citingPaper.get("paperId")  # type: ignore
+                    if paper_id and paper_id not in existing_ids:
+                        cite_data.append(x)
+                        existing_ids.add(paper_id)
+                        cid = get_corpus_id(x)
+                        if cid != -1:
+                            existing_corpus_ids.add(cid)
+                        update = True
+                existing_data.citations._index = (len(cite_data),  # type: ignore
+                                                  existing_ids, existing_corpus_ids)
+            # Citations which couldn't be fetched are tried again next time
+            if not errors:
+                self._add_dont_build_citations(corpus_id)
         return update
 
+    def _add_dont_build_citations(self, corpus_id: int):
+        """Add :code:`corpus_id` to :attr:`_dont_build_citations`
+
+        The oldest id is evicted if it's full.
+
+        Args:
+            corpus_id: Semantic Scholar CorpusId
+
+        """
+        self._dont_build_citations[corpus_id] = time.time()
+        self._dont_build_citations.move_to_end(corpus_id)
+        if len(self._dont_build_citations) > self._dont_build_citations_size:
+            self._dont_build_citations.popitem(last=False)
+
+    def _add_missing_corpus_id(self, corpus_id: int):
+        """Add :code:`corpus_id` to :attr:`_missing_corpus_ids`
+
+        The oldest id is evicted if it's full.
+
+        Args:
+            corpus_id: Semantic Scholar CorpusId
+
+        """
+        self._missing_corpus_ids[corpus_id] = time.time()
+        self._missing_corpus_ids.move_to_end(corpus_id)
+        if len(self._missing_corpus_ids) > self._missing_corpus_ids_size:
+            self._missing_corpus_ids.popitem(last=False)
+
+    def _citations_recently_built(self, corpus_id: int) -> bool:
+        """Check if citations for :code:`corpus_id` were built within the TTL
+
+        Expired entries are removed from :attr:`_dont_build_citations`
+
+        Args:
+            corpus_id: Semantic Scholar CorpusId
+
+        """
+        built_at = self._dont_build_citations.get(corpus_id)
+        if built_at is None:
+            return False
+        if time.time() - built_at > self._dont_build_citations_ttl:
+            del self._dont_build_citations[corpus_id]
+            return False
+        return True
+
 
     def _filter_subr(self, key: str, citation_data: list[Citation], filters: dict[str, Any],
                      num: int) -> list[PaperDetails]:
@@ -1046,30 +1749,67 @@ class SemanticScholar:
             filters: Filter names and kwargs
             num: Number of results to return
 
+        Filters are looked up once and evaluation for an entry stops at the first
+        filter which rejects it. The filters which have rejected the most
+        entries so far, see :attr:`_filter_stats`, are evaluated first.
+
         """
+        unknown = [x for x in filters if x not in self.filters]
+        if unknown:
+            self.logger.debug(f"Unknown filters {unknown}")
+            return []
+        names = sorted(filters, key=self._filter_reject_rate, reverse=True)
+        pipeline = [(self.filters[name], filters[name]) for name in names]
+        rejects = [0] * len(pipeline)
+        evaluated = 0
         retvals = []
         for citation in citation_data:
-            status = True
-            for filter_name, filter_args in filters.items():
-                # key is either citedPaper or citingPaper
-                # This is a bit redundant as key should always be there but this will
-                # catch edge cases
-                if hasattr(citation, key):
-                    try:
-                        # kwargs only
-                        filter_func = self.filters[filter_name]
-                        status = status and filter_func(getattr(citation, key), **filter_args)
-                    except Exception as e:
-                        self.logger.debug(f"Can't apply filter {filter_name} on {citation}: {e}")
-                        status = False
-                else:
-                    status = False
-            if status:
-                retvals.append(PaperDetails(**getattr(citation, key)))
-            if num and len(retvals) == num:
-                break
+            # key is either citedPaper or citingPaper
+            # This is a bit redundant as key should always be there but this will
+            # catch edge cases
+            if isinstance(citation, dict):
+                paper = citation.get(key)
+            else:
+                paper = getattr(citation, key, None)
+            if paper is None:
+                continue
+            evaluated += 1
+            for i, (filter_func, filter_args) in enumerate(pipeline):
+                try:
+                    # kwargs only
+                    if not filter_func(paper, **filter_args):
+                        rejects[i] += 1
+                        break
+                except Exception as e:
+                    self.logger.debug(f"Can't apply filter {filter_func.__name__} on {citation}: {e}")
+                    rejects[i] += 1
+                    break
+            else:
+                retvals.append(PaperDetails(**paper))
+                if num and len(retvals) == num:
+                    break
+        self._update_filter_stats(names, rejects, evaluated)
         return retvals
 
+    def _filter_reject_rate(self, name: str) -> float:
+        calls, rejects = self._filter_stats.get(name, (0, 0))
+        return rejects / calls if calls else 0.0
+
+    def _update_filter_stats(self, names: list[str], rejects: list[int], evaluated: int):
+        """Add the counts from a run of :meth:`_filter_subr` to :attr:`_filter_stats`
+
+        Args:
+            names: Filter names in the order they were evaluated
+            rejects: Number of entries rejected by each filter
+            evaluated: Number of entries evaluated
+
+        """
+        for name, rejected in zip(names, rejects):
+            calls, total = self._filter_stats.get(name, (0, 0))
+            self._filter_stats[name] = (calls + evaluated, total + rejected)
+            # Only the entries passing this filter reach the next one
+            evaluated -= rejected
+
     def filter_citations(self, ID: str, filters: dict[str, Any], num: int = 0) -> list[PaperDetails]:
         """Filter citations based on given filters.
 
@@ -1077,6 +1817,10 @@ class SemanticScholar:
         kwargs to each filter function call.  The functions are called in turn
         and only if all of them return :code:`True` does the filter return `True`.
 
+        If :code:`num` entries from the existing citations pass the filters,
+        the remaining citations are not fetched. Otherwise only the citations
+        added by the fetch are filtered for the rest.
+
         We can also do arbitrary combinations of AND and OR but that's a bit much.
 
         Args:
@@ -1090,6 +1834,18 @@ class SemanticScholar:
             msg = f"data should not be None for ID {ID}"
             return msg          # type: ignore
         else:
+            retvals: list[PaperDetails] = []
+            # Number of citations already filtered
+            filtered = 0
+            if num:
+                # Don't fetch the remaining citations if the existing ones suffice.
+                # NOTE: The data is fixed first so that entries which can't be
+                #       parsed aren't dropped after they're counted
+                _maybe_fix_citation_data(paper_data.citations)
+                retvals = self._filter_subr("citingPaper", paper_data.citations.data, filters, num)
+                if len(retvals) == num:
+                    return retvals
+                filtered = len(paper_data.citations.data)
             update = False
             cite_count = paper_data.details.citationCount
             existing_cite_count = len(paper_data.citations.data)
@@ -1107,7 +1863,10 @@ class SemanticScholar:
                     update = update or _update
                 if update:
                     self.store_paper_data(ID, paper_data)
-            return self._filter_subr("citingPaper", paper_data.citations.data, filters, num)
+            # New citations are appended after the existing ones
+            remaining = num - len(retvals) if num else 0
+            return retvals + self._filter_subr("citingPaper", paper_data.citations.data[filtered:],
+                                               filters, remaining)
 
     def filter_references(self, ID: str, filters: dict[str, Any], num: int = 0):
         """Like :meth:`filter_citations` but for references
@@ -1125,8 +1884,12 @@ class SemanticScholar:
             raise ValueError(f"Data for ID {ID} should be present")
         return self._filter_subr("citedPaper", references, filters, num)
 
-    def recommendations(self, pos_ids: list[str], neg_ids: list[str], count: int = 0):
-        """Fetch recommendations from S2 API
+    async def _recommendations(self, pos_ids: list[str], neg_ids: list[str],
+                               count: int = 0) -> dict | list:
+        """Fetch recommendations and their paper details from the API
+
+        Both the recommendations and the details are fetched on the shared
+        client session.
 
         Args:
             pos_ids: Positive paper ids
@@ -1135,23 +1898,44 @@ class SemanticScholar:
 
         """
         root_url = "https://api.semanticscholar.org/recommendations/v1/papers"
+        session = await self._get_session()
         if neg_ids:
-            response = self._post(root_url,
-                                  data={"positivePaperIds": pos_ids,
-                                        "negativePaperIds": neg_ids})
+            response = await self._apost(session, root_url,
+                                         data={"positivePaperIds": pos_ids,
+                                               "negativePaperIds": neg_ids})
         else:
-            response = self._get(f"{root_url}/forpaper/{pos_ids[0]}")
-        # FIXME: As this has changed from requests, this should be different
-        if response.status_code == 200:
-            recommendations = json.loads(response.content)["recommendedPapers"]
+            response = await self._aget(session, f"{root_url}/forpaper/{pos_ids[0]}")
+        if "recommendedPapers" in response:
+            recommendations = response["recommendedPapers"]
+            if count:
+                recommendations = recommendations[:count]
             urls = [self.details_url(x["paperId"])
                     for x in recommendations]
-            if count:
-                urls = urls[:count]
-            results = asyncio.run(self._get_some_urls(urls))
-            return dumps_json(results)
+            return await self._get_some_urls(urls)
         else:
-            return dumps_json({"error": json.loads(response.content)})
+            return {"error": response}
+
+    def recommendations(self, pos_ids: list[str], neg_ids: list[str], count: int = 0):
+        """Fetch recommendations from S2 API
+
+        Args:
+            pos_ids: Positive paper ids
+            neg_ids: Negative paper ids
+            count: Number of recommendations to fetch
+
+        """
+        return dumps_json(self._run(self._recommendations(pos_ids, neg_ids, count)))
+
+    async def arecommendations(self, pos_ids: list[str], neg_ids: list[str], count: int = 0):
+        """Like :meth:`recommendations` but can be awaited.
+
+        Args:
+            pos_ids: Positive paper ids
+            neg_ids: Negative paper ids
+            count: Number of recommendations to fetch
+
+        """
+        return dumps_json(await self._arun(self._recommendations(pos_ids, neg_ids, count)))
 
     def author_url(self, ID: str) -> str:
         """Return the author url for a given :code:`ID`
@@ -1160,9 +1944,7 @@ class SemanticScholar:
             ID: author identifier
 
         """
-        fields = ",".join(self.config.author.fields)
-        limit = self.config.author.limit
-        return f"{self._root_url}/author/{ID}?fields={fields}&limit={limit}"
+        return self._url_templates["author"].format(ID=ID)
 
     def author_papers_url(self, ID: str) -> str:
         """Return the author papers url for a given :code:`ID`
@@ -1171,9 +1953,7 @@ class SemanticScholar:
             ID: author identifier
 
         """
-        fields = ",".join(self.config.author_papers.fields)
-        limit = self.config.author_papers.limit
-        return f"{self._root_url}/author/{ID}/papers?fields={fields}&limit={limit}"
+        return self._url_templates["author_papers"].format(ID=ID)
 
     async def _author(self, ID: str) -> dict:
         """Fetch the author data from the API
@@ -1196,7 +1976,18 @@ class SemanticScholar:
             ID: author identifier
 
         """
-        result = asyncio.run(self._author(ID))
+        result = self._run(self._author(ID))
+        return {"author": result["author"],
+                "papers": result["papers"]["data"]}
+
+    async def aget_author_papers(self, ID: str) -> dict:
+        """Like :meth:`get_author_papers` but can be awaited.
+
+        Args:
+            ID: author identifier
+
+        """
+        result = await self._arun(self._author(ID))
         return {"author": result["author"],
                 "papers": result["papers"]["data"]}
 
@@ -1207,8 +1998,5 @@ class SemanticScholar:
             query: query to search
 
         """
-        terms = "+".join(re.sub(r"[^a-z0-9]", " ", query, flags=re.IGNORECASE).split(" "))
-        fields = ",".join(self.config.search.fields)
-        limit = self.config.search.limit
-        url = f"{self._root_url}/paper/search?query={terms}&fields={fields}&limit={limit}"
-        return self._get(url)
+        terms = "+".join(_non_alnum_re.sub(" ", query).split())
+        return self._get(self._url_templates["search"].format(terms=terms))
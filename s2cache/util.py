@@ -1,5 +1,14 @@
+import os
 import json
+import mmap
 import dataclasses
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 
 def json_serialize(obj):
@@ -10,6 +19,9 @@ def json_serialize(obj):
 
 
 def dumps_json(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_serialize,
+                            option=orjson.OPT_NON_STR_KEYS).decode()
     return json.dumps(obj, default=json_serialize)
 
 
@@ -17,6 +29,50 @@ def dump_json(obj, file) -> None:
     json.dump(obj, file, default=json_serialize)
 
 
+def dumpb_json(obj) -> bytes:
+    """Serialize :code:`obj` to JSON :class:`bytes` with :mod:`orjson` if it's installed
+
+    Args:
+        obj: Object to serialize
+
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=json_serialize, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=json_serialize).encode()
+
+
+def loads_json(data: str | bytes):
+    """Parse JSON :code:`data` with :mod:`orjson` if it's installed, else with :mod:`json`
+
+    Args:
+        data: JSON string or bytes
+
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_json_file(fpath, mmap_min_size: int = 65536):
+    """Load JSON from file :code:`fpath`
+
+    If :mod:`orjson` is installed, files of at least :code:`mmap_min_size`
+    bytes are memory mapped and parsed without reading them into memory first.
+
+    Args:
+        fpath: Path of the file
+        mmap_min_size: Minimum size of the file to memory map
+
+    """
+    with open(fpath, "rb") as f:
+        if orjson is None or os.fstat(f.fileno()).st_size < mmap_min_size:
+            return loads_json(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as buf:
+                return orjson.loads(buf)
+
+
+@lru_cache(maxsize=None)
 def id_to_name(ID: str):
     """Change the ExternalId returned by the S2 API to the name
 
@@ -30,6 +30,21 @@ def s2():
     return s2
 
 
+@pytest.fixture
+def tmp_s2(tmp_path):
+    """Client on a copy of the cache data which the tests are free to modify"""
+    cache_dir = tmp_path.joinpath("cache_data")
+    shutil.copytree("tests/cache_data", cache_dir)
+    shutil.copy(cache_dir.joinpath("metadata.jsonl.bak"),
+                cache_dir.joinpath("metadata.jsonl"))
+    s2 = SemanticScholar(cache_dir=cache_dir,
+                         config_file="tests/config.yaml",
+                         logger_name="s2-test")
+    yield s2
+    s2.close()
+    s2._cache_backend.flush_paper_data()
+
+
 @pytest.fixture
 def cache():
     shutil.copy("tests/cache_data/metadata.json.bak",
@@ -1,6 +1,8 @@
 import pytest
 from s2cache.models import PaperDetails
 
+from util import use_fake_session, get_ID_with_data, citation_pages_handler
+
 
 def test_filters_citations(s2):
     key = "a925f818f787e142c5f6bcb7bbd7ede2deb34860"
@@ -23,3 +25,44 @@ def test_filters_references(s2):
     assert isinstance(result[0], PaperDetails)
     assert result[0].paperId
 
+
+
+def test_filters_most_rejecting_filter_is_evaluated_first(tmp_s2):
+    citations = [{"contexts": [],
+                  "citingPaper": {"paperId": str(i), "title": f"Paper {i}", "year": 2000 + i % 20,
+                                  "citationCount": 0, "influentialCitationCount": 0,
+                                  "authors": []}}
+                 for i in range(100)]
+    filters = {"year": {"min": 2000, "max": 2018},
+               "title": {"title_re": "Paper 1", "invert": False}}
+    result = tmp_s2._filter_subr("citingPaper", citations, filters, 0)
+    assert len(result) == 10
+    assert tmp_s2._filter_stats == {"year": (100, 5), "title": (95, 85)}
+    # title rejects more and is now evaluated first, with the same result
+    assert tmp_s2._filter_subr("citingPaper", citations, filters, 0) == result
+    assert tmp_s2._filter_stats == {"year": (100 + 11, 5 + 1), "title": (95 + 100, 85 + 89)}
+
+
+def test_filters_citations_existing_suffice_for_num(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    paper_data.details.citationCount = len(paper_data.citations.data) + 300
+    expected = [x["citingPaper"]["paperId"] for x in paper_data.citations.data[:2]]
+    session = use_fake_session(tmp_s2, monkeypatch, citation_pages_handler(250))
+    result = tmp_s2.filter_citations(ID, {"citationcount": {"min": 0}}, num=2)
+    assert [x.paperId for x in result] == expected
+    assert not session.calls
+    assert tmp_s2._filter_stats == {"citationcount": (2, 0)}
+
+
+def test_filters_citations_existing_are_filtered_once(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    existing = len(paper_data.citations.data)
+    paper_data.details.citationCount = existing + 300
+    use_fake_session(tmp_s2, monkeypatch, citation_pages_handler(250))
+    filters = {"title": {"title_re": "Paper [0-9]+$", "invert": False}}
+    result = tmp_s2.filter_citations(ID, filters, num=5)
+    assert [x.paperId for x in result] == [f"citing{i}" for i in range(5)]
+    # The existing citations are evaluated once and the fetched ones till num pass
+    assert tmp_s2._filter_stats == {"title": (existing + 5, existing)}
@@ -1,10 +1,15 @@
 import pytest
+import gc
 import os
 import json
 import random
+import weakref
 
 from s2cache.models import PaperDetails, PaperData
 from s2cache import semantic_scholar as ss
+from s2cache.jsonl_backend import JSONLBackend
+
+from util import get_ID_with_data
 
 
 def get_metadata(cache_dir):
@@ -41,3 +46,51 @@ def test_jsonl_rebuild_jsonl_metadata(s2):
     s2.rebuild_metadata()
     assert metadata_file.exists()
     assert metadata == s2._metadata
+
+
+def test_jsonl_files_are_paper_data_files(s2, cache_files):
+    backend = s2._cache_backend
+    assert set(backend.files) == {x for x in cache_files if "duplicates" not in x}
+    assert backend.get_paper_data("not_a_paper_id") is None
+
+
+def test_jsonl_dump_paper_data_round_trips(tmp_s2):
+    backend = tmp_s2._cache_backend
+    ID = get_ID_with_data(tmp_s2)
+    data = tmp_s2._check_cache(ID)
+    for i in range(10):
+        data.details.title = f"Title {i}"
+        backend.dump_paper_data(ID, data)
+        # Pending data is read back before it's written
+        assert backend.get_paper_data(ID)["details"]["title"] == f"Title {i}"
+    backend.flush_paper_data()
+    with open(backend._root_dir.joinpath(ID)) as f:
+        assert json.load(f)["details"]["title"] == "Title 9"
+    assert not [x for x in os.listdir(backend._root_dir) if x.endswith("~")]
+
+
+def test_jsonl_backend_is_garbage_collected_after_writing(tmp_s2):
+    backend = JSONLBackend(tmp_s2._cache_dir, "s2-test")
+    ID = get_ID_with_data(tmp_s2)
+    data = tmp_s2._check_cache(ID)
+    data.details.title = "Collected"
+    backend.dump_paper_data(ID, data)
+    backend.update_jsonl_metadata_on_disk("collected_id", {"DOI": "10.1/collected"})
+    ref = weakref.ref(backend)
+    del backend
+    gc.collect()
+    assert ref() is None
+    # Pending writes are finished when it's collected
+    with open(tmp_s2._cache_dir.joinpath(ID)) as f:
+        assert json.load(f)["details"]["title"] == "Collected"
+    assert "collected_id" in tmp_s2._cache_backend.load_jsonl_metadata()
+
+
+def test_jsonl_paper_data_written_by_another_backend_is_found(tmp_s2):
+    backend = tmp_s2._cache_backend
+    assert backend.get_paper_data("written_elsewhere") is None
+    other = JSONLBackend(tmp_s2._cache_dir, "s2-test")
+    ID = get_ID_with_data(tmp_s2)
+    other.dump_paper_data("written_elsewhere", tmp_s2._check_cache(ID))
+    other.flush_paper_data()
+    assert backend.get_paper_data("written_elsewhere")["details"]["paperId"] == ID
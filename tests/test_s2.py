@@ -1,14 +1,22 @@
 import pytest
+import gc
+import copy
+import asyncio
 import time
 import os
 import json
 import random
+import weakref
+
+import aiohttp
 from s2cache.models import PaperDetails, PaperData
 from s2cache import semantic_scholar as ss
+from s2cache.config import default_config, load_config
 
 from util import (get_random_ID, check_ID_in_store,
                   remove_ID_from_store, remove_ID_from_memory,
-                  remove_random_item_from_store, remove_random_item_from_metadata)
+                  remove_random_item_from_store, remove_random_item_from_metadata,
+                  use_fake_session, get_ID_with_data, citation_pages_handler)
 
 
 def test_s2_init(s2):
@@ -107,6 +115,13 @@ def test_s2_graph_search(s2):
     assert result["data"][0]["paperId"] == "8e0be569ea77b8cb29bb0e8b031887630fe7a96c"
 
 
+def test_s2_search_terms_skip_separator_runs(tmp_s2, monkeypatch):
+    session = use_fake_session(tmp_s2, monkeypatch, lambda *args: (200, {"data": []}))
+    tmp_s2.search("  Breiman -- Random-Forests: a review! ")
+    query = session.calls[-1][1].split("query=")[1].split("&")[0]
+    assert query == "Breiman+Random+Forests+a+review"
+
+
 def test_s2_update_citation_count_before_writing(s2):
     pass
 
@@ -115,6 +130,22 @@ def test_s2_get_corpus_id_from_references(s2):
     pass
 
 
+def test_s2_get_corpus_id():
+    paper = {"paperId": "a", "title": "A Paper", "citationCount": 0,
+             "influentialCitationCount": 0, "authors": [],
+             "externalIds": {"CorpusId": 1234, "DOI": "10.1/a"}}
+    assert ss.get_corpus_id(PaperDetails(**paper)) == 1234
+    assert ss.get_corpus_id(ss.Citation(contexts=[], citingPaper=paper)) == 1234
+    assert ss.get_corpus_id({"contexts": [], "citingPaper": paper}) == 1234
+    assert ss.get_corpus_id(paper) == 1234
+    assert ss.get_corpus_id({**paper, "externalIds": {"CorpusId": "1234"}}) == 1234
+    # Missing
+    assert ss.get_corpus_id({**paper, "externalIds": {"DOI": "10.1/a"}}) == -1
+    assert ss.get_corpus_id(PaperDetails(**{**paper, "externalIds": {}})) == -1
+    assert ss.get_corpus_id({"paperId": "a"}) == -1
+    assert ss.get_corpus_id({"contexts": [], "citingPaper": {"paperId": "a"}}) == -1
+
+
 def test_s2_fetch_data_with_no_transform_is_correct(s2, cache_files):
     ID = random.choice(cache_files)
     data = s2.fetch_from_cache_or_api(True, ID, False, True)
@@ -145,16 +176,30 @@ def test_s2_get_updated_paper_id(s2):
     assert data.duplicateId is None
 
 
-def test_s2_id_to_corpus_id_fails_for_invalid_id(s2):
-    pass
+def test_s2_id_to_corpus_id_fails_for_invalid_id(tmp_s2, monkeypatch):
+    use_fake_session(tmp_s2, monkeypatch, paper_handler)
+    assert isinstance(tmp_s2.id_to_corpus_id("ss", "unknown1"), ss.Error)
+    assert isinstance(tmp_s2.id_to_corpus_id("not_an_id_type", "1234"), ss.Error)
 
 
-def test_s2_id_to_corpus_id_correct_for_valid_id_already_in_cache(s2):
-    pass
+def test_s2_id_to_corpus_id_correct_for_valid_id_already_in_cache(tmp_s2, monkeypatch):
+    session = use_fake_session(tmp_s2, monkeypatch, paper_handler)
+    ID, ext_ids = next((k, v) for k, v in tmp_s2._metadata.items()
+                       if v.get("CorpusId") and v.get("DOI"))
+    assert tmp_s2.id_to_corpus_id("ss", ID) == ext_ids["CorpusId"]
+    assert tmp_s2.id_to_corpus_id("doi", ext_ids["DOI"]) == ext_ids["CorpusId"]
+    assert not session.calls
 
 
-def test_s2_id_to_corpus_id_correct_for_valid_id_not_in_cache(s2):
-    pass
+def test_s2_id_to_corpus_id_correct_for_valid_id_not_in_cache(tmp_s2, monkeypatch):
+    session = use_fake_session(tmp_s2, monkeypatch, paper_handler)
+    assert tmp_s2.id_to_corpus_id("arxiv", "2101.00001") == "1234"
+    assert session.calls[0][1] == tmp_s2.details_url("ARXIV:2101.00001")
+    assert tmp_s2._metadata["paper210100001"]["CorpusId"] == "1234"
+    # Cached now
+    num_calls = len(session.calls)
+    assert tmp_s2.id_to_corpus_id("ss", "paper210100001") == "1234"
+    assert len(session.calls) == num_calls
 
 
 def test_s2_get_citations_with_range(s2):
@@ -212,9 +257,10 @@ def test_s2_data_build_citations_without_offset_limit(s2):
     data = s2.get_details_for_id("corpusid", ID, False, False)
     existing_ids = [ss.get_corpus_id(PaperDetails(**x)) for x in data.citations]
     total_fetchable = len(set(vals).union(set(existing_ids)))
-    citations = s2._build_citations_from_stored_data(corpus_id=ID,
-                                                     existing_ids=existing_ids,
-                                                     cite_count=data.citationCount)
+    citations, errors = s2._build_citations_from_stored_data(corpus_id=ID,
+                                                             existing_ids=existing_ids,
+                                                             cite_count=data.citationCount)
+    assert not errors
     assert citations.offset == 0
     assert len(citations.data) == total_fetchable - len(existing_ids)
     assert hasattr(citations.data[0], "citingPaper") and hasattr(citations.data[0], "contexts")
@@ -249,6 +295,115 @@ def test_s2_citations_greater_than_10000(s2):
     pass
 
 
+def test_s2_filter_citations_unchanged_pages_are_reused(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    existing = len(paper_data.citations.data)
+    # The API serves fewer citations than it reports, so they're fetched each time
+    paper_data.details.citationCount = existing + 300
+    session = use_fake_session(tmp_s2, monkeypatch, citation_pages_handler(250))
+    first = tmp_s2.filter_citations(ID, {})
+    assert len(first) == existing + 250
+    num_calls = len(session.calls)
+    assert not any("If-None-Match" in x[2]["headers"] for x in session.calls)
+    second = tmp_s2.filter_citations(ID, {})
+    calls = session.calls[num_calls:]
+    assert calls and all(x[2]["headers"]["If-None-Match"] == "v1" for x in calls)
+    assert second == first
+
+
+def test_s2_etags_are_bounded_by_size_of_kept_bodies(tmp_s2):
+    tmp_s2._etags_max_bytes = 30
+    for url in ["a", "b", "c"]:
+        tmp_s2._add_etag(url, "v1", b"0123456789")
+    assert tmp_s2._etags_bytes == 30
+    tmp_s2._add_etag("d", "v1", b"0123456789")
+    assert list(tmp_s2._etags) == ["b", "c", "d"]
+    tmp_s2._add_etag("b", "v2", b"01234")
+    assert list(tmp_s2._etags) == ["c", "d", "b"]
+    assert tmp_s2._etags_bytes == 25
+    # Too large to keep
+    tmp_s2._add_etag("c", "v2", b"0" * 31)
+    assert list(tmp_s2._etags) == ["d", "b"]
+    assert tmp_s2._etags_bytes == 15
+
+
+def test_s2_etags_evict_the_least_recently_used_page(tmp_s2, monkeypatch):
+    def handler(method, url, kwargs):
+        if kwargs["headers"].get("If-None-Match") == "v1":
+            return 304, b""
+        return 200, {"url": url}, {"ETag": "v1"}
+
+    session = use_fake_session(tmp_s2, monkeypatch, handler)
+    tmp_s2._etags_max_bytes = 3 * len(b'{"url": "http://s2/a"}')
+    urls = ["http://s2/a", "http://s2/b", "http://s2/c"]
+    tmp_s2._run(tmp_s2._get_some_urls(urls, conditional=True))
+    assert list(tmp_s2._etags) == urls
+    # Unchanged, served from the kept body and now the most recently used
+    assert tmp_s2._run(tmp_s2._get_some_urls(urls[:1], conditional=True)) ==\
+        [{"url": "http://s2/a"}]
+    assert session.calls[-1][2]["headers"]["If-None-Match"] == "v1"
+    tmp_s2._run(tmp_s2._get_some_urls(["http://s2/d"], conditional=True))
+    assert list(tmp_s2._etags) == ["http://s2/c", "http://s2/a", "http://s2/d"]
+
+
+def test_s2_ensure_all_citations_after_citations_are_replaced(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    paper_data.details.citationCount = len(paper_data.citations.data) + 300
+    use_fake_session(tmp_s2, monkeypatch, citation_pages_handler(250))
+    assert len(tmp_s2._ensure_all_citations(ID).data) == 250
+    paper_data.citations = ss.Citations(offset=0, data=[])
+    # All the pages are unchanged now
+    citations = tmp_s2._ensure_all_citations(ID)
+    assert len(citations.data) == 250
+    tmp_s2._update_citations(citations, paper_data.citations)
+    assert len(paper_data.citations.data) == 250
+
+
+def test_s2_urls_and_fields_are_rebuilt_when_config_is_set(tmp_s2):
+    config = default_config()
+    load_config(config, "tests/diff_config.yaml")
+    config.details.fields.remove("abstract")
+    assert "limit=100" in tmp_s2.citations_url("a")
+    assert "citationCount" in tmp_s2.author_papers_url("a")
+    tmp_s2.config = config
+    root = tmp_s2._root_url
+    assert tmp_s2.citations_url("a") ==\
+        f"{root}/paper/a/citations?fields={','.join(config.citations.fields)}&limit=55"
+    assert tmp_s2.author_papers_url("a") ==\
+        f"{root}/author/a/papers?fields=authors,abstract,title,venue,paperId,year,url,"\
+        "externalIds&limit=100"
+    assert tmp_s2.details_url("a") == f"{root}/paper/a?fields={','.join(config.details.fields)}"
+    assert "abstract" not in tmp_s2.details_url("a")
+    assert tmp_s2._required_fields["details"] == frozenset(config.details.fields)
+
+
+def test_s2_validate_fields_with_citation_fields_in_config(tmp_s2):
+    config = copy.deepcopy(tmp_s2.config)
+    config.citations.fields.append("intents")
+    tmp_s2.config = config
+    paper = {x: None for x in config.details.fields}
+    data = {"details": paper,
+            "citations": {"offset": 0, "data": [{"contexts": [], "intents": [],
+                                                 "citingPaper": paper}]},
+            "references": {"offset": 0, "data": [{"contexts": [], "citedPaper": paper}]}}
+    assert tmp_s2._validate_fields(data)
+    assert "intents" not in tmp_s2._fields_strings["citing_paper"]
+    data["citations"]["data"][0]["citingPaper"] = {k: v for k, v in paper.items()
+                                                   if k != "title"}
+    assert not tmp_s2._validate_fields(data)
+    data["citations"]["data"][0] = {"contexts": [], "citingPaper": paper}
+    assert not tmp_s2._validate_fields(data)
+
+
+def test_s2_update_citations_with_empty_data(s2):
+    existing = ss.Citations(offset=0, data=[])
+    new = ss.Citations(offset=0, data=[ss.Citation(contexts=[], citingPaper={"paperId": "a"})])
+    assert len(s2._update_citations(existing, new).data) == 1
+    assert len(s2._update_citations(new, ss.Citations(offset=0, data=[])).data) == 1
+
+
 # def test_s2_data_build_citations_with_offset_limit(s2):
 #     # Has > 140 citations but < 200
 #     ID = 236511142
@@ -291,3 +446,255 @@ def test_s2_citations_greater_than_10000(s2):
 #     assert citations["offset"] == 0
 #     assert len(citations["data"]) == len(vals) % 50
 
+
+
+def test_s2_recently_built_citations_are_not_refreshed(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    corpus_id = ss.get_corpus_id(paper_data.details)
+    built_at = time.time() - 60
+    tmp_s2._dont_build_citations[corpus_id] = built_at
+
+    def build(*args, **kwargs):
+        assert False, "Should not build again"
+
+    monkeypatch.setattr(tmp_s2, "_build_citations_from_stored_data", build)
+    assert not tmp_s2._maybe_fetch_citations_greater_than_10000(paper_data)
+    assert tmp_s2._dont_build_citations[corpus_id] == built_at
+
+
+class FakeCorpusCache:
+    def __init__(self, citations):
+        self.citations = citations
+
+    def get_citations(self, corpus_id):
+        return self.citations
+
+
+def test_s2_citations_are_built_again_after_errors(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    corpus_id = ss.get_corpus_id(paper_data.details)
+    monkeypatch.setattr(tmp_s2, "_corpus_cache", FakeCorpusCache({1, 2, 3}))
+    use_fake_session(tmp_s2, monkeypatch, lambda *args: (500, {"message": "Internal error"}))
+    assert not tmp_s2._maybe_fetch_citations_greater_than_10000(paper_data)
+    assert corpus_id not in tmp_s2._dont_build_citations
+
+    def handler(method, url, kwargs):
+        ids = json.loads(kwargs["data"])["ids"]
+        return 200, [{"paperId": x} for x in ids]
+
+    use_fake_session(tmp_s2, monkeypatch, handler)
+    assert tmp_s2._maybe_fetch_citations_greater_than_10000(paper_data)
+    assert corpus_id in tmp_s2._dont_build_citations
+
+
+def test_s2_client_state_is_merged_across_clients(tmp_s2):
+    cache_dir = tmp_s2._cache_dir
+    other = ss.SemanticScholar(cache_dir=cache_dir, config_file="tests/config.yaml")
+    tmp_s2._add_dont_build_citations(1)
+    tmp_s2._filter_stats["year"] = (10, 5)
+    other._add_dont_build_citations(2)
+    other._filter_stats["year"] = (20, 1)
+    other.dump_client_state()
+    tmp_s2.dump_client_state()
+    new = ss.SemanticScholar(cache_dir=cache_dir, config_file="tests/config.yaml")
+    assert set(new._dont_build_citations) == {1, 2}
+    assert new._filter_stats == {"year": (20, 1)}
+
+
+def test_s2_client_is_garbage_collected(tmp_s2, monkeypatch):
+    client = ss.SemanticScholar(cache_dir=tmp_s2._cache_dir, config_file="tests/config.yaml")
+    use_fake_session(client, monkeypatch, lambda *args: (200, {"paperId": "a"}))
+    assert client._get("http://s2/paper") == {"paperId": "a"}
+    thread = client._event_loop.thread
+    assert thread.is_alive()
+    # monkeypatch keeps the client till it's undone
+    monkeypatch.undo()
+    ref = weakref.ref(client)
+    del client
+    gc.collect()
+    assert ref() is None
+    # The loop is stopped along with it
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_s2_missing_corpus_ids_are_skipped_till_they_expire(tmp_s2, monkeypatch):
+    def handler(method, url, kwargs):
+        ids = json.loads(kwargs["data"])["ids"]
+        return 200, [None if x == "CorpusID:2" else {"paperId": x} for x in ids]
+
+    session = use_fake_session(tmp_s2, monkeypatch, handler)
+    assert len(tmp_s2._run(tmp_s2._get_citing_papers([1, 2, 3]))[0]) == 2
+    assert 2 in tmp_s2._missing_corpus_ids
+    tmp_s2._run(tmp_s2._get_citing_papers([1, 2, 3]))
+    assert json.loads(session.calls[-1][2]["data"])["ids"] == ["CorpusID:1", "CorpusID:3"]
+    tmp_s2._missing_corpus_ids[2] = time.time() - tmp_s2._missing_corpus_ids_ttl - 1
+    tmp_s2._run(tmp_s2._get_citing_papers([1, 2, 3]))
+    assert len(json.loads(session.calls[-1][2]["data"])["ids"]) == 3
+    tmp_s2.dump_client_state()
+    new = ss.SemanticScholar(cache_dir=tmp_s2._cache_dir, config_file="tests/config.yaml")
+    assert 2 in new._missing_corpus_ids
+
+
+def test_s2_error_entries_in_paper_batches_are_skipped(tmp_s2, monkeypatch):
+    def handler(method, url, kwargs):
+        ids = json.loads(kwargs["data"])["ids"]
+        if "CorpusID:3" in ids:
+            return 500, {"message": "Internal error"}
+        return 200, [{"error": "Not available"} if x == "CorpusID:5" else {"paperId": x}
+                     for x in ids]
+
+    use_fake_session(tmp_s2, monkeypatch, handler)
+    tmp_s2._paper_batch_size = 2
+    data, errors = tmp_s2._run(tmp_s2._get_citing_papers([1, 2, 3, 4, 5, 6]))
+    assert sorted(x.citingPaper["paperId"] for x in data) ==\
+        ["CorpusID:1", "CorpusID:2", "CorpusID:6"]
+    assert all(isinstance(x, ss.Citation) for x in data)
+    assert errors == 3
+    assert not tmp_s2._missing_corpus_ids
+
+
+def test_s2_error_pages_of_citations_are_skipped(tmp_s2, monkeypatch):
+    ID = get_ID_with_data(tmp_s2)
+    paper_data = tmp_s2._check_cache(ID)
+    paper_data.details.citationCount = len(paper_data.citations.data) + 300
+    pages = citation_pages_handler(300)
+
+    def handler(method, url, kwargs):
+        if "offset=100" in url:
+            return 500, {"message": "Internal error"}
+        return pages(method, url, kwargs)
+
+    use_fake_session(tmp_s2, monkeypatch, handler)
+    tmp_s2._batch_size = 100
+    citations = tmp_s2._ensure_all_citations(ID)
+    assert [x.citingPaper["paperId"] for x in citations.data] ==\
+        [f"citing{i}" for i in [*range(100), *range(200, 300)]]
+    # Not all the pages were fetched
+    assert citations.next is None
+
+
+def test_s2_requests_are_retried_and_failures_dont_abort_other_urls(tmp_s2, monkeypatch):
+    attempts = {}
+
+    def handler(method, url, kwargs):
+        attempts[url] = attempts.get(url, 0) + 1
+        if url.endswith("flaky") and attempts[url] < 3:
+            return aiohttp.ClientConnectionError("Connection reset")
+        if url.endswith("busy") and attempts[url] < 2:
+            return 429, {"message": "Too Many Requests"}
+        if url.endswith("gateway"):
+            return 502, b"<html>Bad Gateway</html>"
+        if url.endswith("down"):
+            return aiohttp.ClientConnectionError("Connection refused")
+        return 200, {"url": url}
+
+    use_fake_session(tmp_s2, monkeypatch, handler)
+    urls = ["http://s2/ok", "http://s2/flaky", "http://s2/busy", "http://s2/gateway",
+            "http://s2/down"]
+    ok, flaky, busy, gateway, down = tmp_s2._run(tmp_s2._get_some_urls(urls))
+    assert ok == {"url": "http://s2/ok"}
+    assert flaky == {"url": "http://s2/flaky"}
+    assert busy == {"url": "http://s2/busy"}
+    assert "error" in gateway and "error" in down
+    assert attempts["http://s2/gateway"] == attempts["http://s2/down"] == tmp_s2._max_retries
+
+
+def test_s2_batch_urls_are_clamped_to_10000(tmp_s2):
+    batch_limits = ss.SemanticScholar._batch_limits
+    limits = batch_limits(12000, 1000)
+    assert len(limits) == 10
+    assert limits[-1] == (1000, 9000)
+    assert batch_limits(12000, 3000) == ((3000, 0), (3000, 3000), (3000, 6000), (1000, 9000))
+    # Pages starting at or beyond 10000 are dropped
+    limits = batch_limits(20000, 2500)
+    assert len(limits) == 4
+    assert sum(x[0] for x in limits) == 10000
+    assert batch_limits(0, 100) == ()
+    tmp_s2._batch_size = 100
+    assert tmp_s2._batch_urls(150, "u?fields=f") == ["u?fields=f&limit=100&offset=0",
+                                                     "u?fields=f&limit=100&offset=100"]
+    hits = batch_limits.cache_info().hits
+    # Cached across papers
+    assert tmp_s2._batch_urls(150, "v?fields=f") == ["v?fields=f&limit=100&offset=0",
+                                                     "v?fields=f&limit=100&offset=100"]
+    assert batch_limits.cache_info().hits == hits + 1
+
+
+def api_handler(method, url, kwargs):
+    """Serve recommendations, paper details and author data
+
+    """
+    path = url.split("?")[0]
+    if path.endswith("/recommendations/v1/papers") or "/forpaper/" in path:
+        return 200, {"recommendedPapers": [{"paperId": "rec1"}, {"paperId": "rec2"},
+                                           {"paperId": "rec3"}]}
+    if "/author/" in path:
+        if path.endswith("/papers"):
+            return 200, {"offset": 0, "data": [{"paperId": "p1"}, {"paperId": "p2"}]}
+        return 200, {"authorId": path.rsplit("/", 1)[1], "name": "An Author"}
+    return 200, {"paperId": path.rsplit("/", 1)[1], "title": "A Paper"}
+
+
+def test_s2_recommendations_requests_and_result(tmp_s2, monkeypatch):
+    session = use_fake_session(tmp_s2, monkeypatch, api_handler)
+    root = "https://api.semanticscholar.org/recommendations/v1/papers"
+    result = json.loads(tmp_s2.recommendations(["a"], [], 2))
+    assert [x[:2] for x in session.calls] == [("GET", f"{root}/forpaper/a"),
+                                              ("GET", tmp_s2.details_url("rec1")),
+                                              ("GET", tmp_s2.details_url("rec2"))]
+    assert result == [{"paperId": "rec1", "title": "A Paper"},
+                      {"paperId": "rec2", "title": "A Paper"}]
+    session.calls.clear()
+    result = json.loads(tmp_s2.recommendations(["a"], ["b"]))
+    method, url, kwargs = session.calls[0]
+    assert (method, url) == ("POST", root)
+    assert kwargs["headers"]["Content-Type"] == "application/json"
+    assert json.loads(kwargs["data"]) == {"positivePaperIds": ["a"], "negativePaperIds": ["b"]}
+    assert [x["paperId"] for x in result] == ["rec1", "rec2", "rec3"]
+    use_fake_session(tmp_s2, monkeypatch, lambda *args: (404, {"message": "Not found"}))
+    assert json.loads(tmp_s2.recommendations(["a"], [])) ==\
+        {"error": {"message": "Not found"}}
+
+
+def test_s2_async_apis_match_sync_apis(tmp_s2, monkeypatch):
+    use_fake_session(tmp_s2, monkeypatch, api_handler)
+    assert asyncio.run(tmp_s2.arecommendations(["a"], [], 2)) ==\
+        tmp_s2.recommendations(["a"], [], 2)
+    assert asyncio.run(tmp_s2.arecommendations(["a"], ["b"])) ==\
+        tmp_s2.recommendations(["a"], ["b"])
+    papers = asyncio.run(tmp_s2.aget_author_papers("1234"))
+    assert papers == tmp_s2.get_author_papers("1234")
+    assert papers == {"author": {"authorId": "1234", "name": "An Author"},
+                      "papers": [{"paperId": "p1"}, {"paperId": "p2"}]}
+
+
+def paper_handler(method, url, kwargs):
+    """Serve details without citations and references for any paper
+
+    """
+    path = url.split("?")[0]
+    if path.endswith("/citations") or path.endswith("/references"):
+        return 200, {"offset": 0, "data": []}
+    ID = path.rsplit("/", 1)[1]
+    if ID.startswith("unknown"):
+        return 404, {"error": "Paper not found"}
+    paper_id = ID.split(":")[-1].replace(".", "")
+    return 200, {"paperId": f"paper{paper_id}", "title": "A Paper", "citationCount": 0,
+                 "influentialCitationCount": 0, "authors": [],
+                 "externalIds": {"CorpusId": 1234, "DOI": f"10.1/{paper_id}"}}
+
+
+def test_s2_astore_details_and_get_stores_the_data(tmp_s2, monkeypatch):
+    session = use_fake_session(tmp_s2, monkeypatch, paper_handler)
+    data = asyncio.run(tmp_s2.astore_details_and_get("new1"))
+    assert isinstance(data, PaperData)
+    assert len(session.calls) == 3
+    assert data.details.paperId == "papernew1"
+    tmp_s2._cache_backend.flush_paper_data()
+    with open(tmp_s2._cache_dir.joinpath("papernew1")) as f:
+        assert json.load(f)["details"]["title"] == "A Paper"
+    assert tmp_s2._metadata["papernew1"]["DOI"] == "10.1/new1"
+    assert "papernew1" in tmp_s2._cache_backend.load_jsonl_metadata()
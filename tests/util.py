@@ -1,4 +1,5 @@
 import os
+import json
 import random
 
 
@@ -60,3 +61,85 @@ def check_ID_in_store(s2, ID):
         return s2._cache_backend._root_dir.joinpath(ID).exists()
     else:
         assert False
+
+
+class FakeResponse:
+    """Stand in for an :mod:`aiohttp` response
+
+    """
+    def __init__(self, status, data=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = data if isinstance(data, bytes) else json.dumps(data).encode()
+
+    async def read(self):
+        return self._body
+
+    def release(self):
+        pass
+
+
+class FakeSession:
+    """Stand in for :class:`aiohttp.ClientSession` which serves responses from a handler
+
+    The :code:`handler` is called with the method, url and the keyword arguments
+    of each request and returns either the arguments to :class:`FakeResponse` or an
+    exception to raise.
+
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+        self.closed = False
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.handler(method, url, kwargs)
+        if isinstance(result, Exception):
+            raise result
+        return FakeResponse(*result)
+
+    async def close(self):
+        self.closed = True
+
+
+def use_fake_session(s2, monkeypatch, handler):
+    """Serve all the requests of :code:`s2` from :code:`handler` without retry delays
+
+    """
+    session = FakeSession(handler)
+
+    async def get_session():
+        return session
+
+    monkeypatch.setattr(s2, "_get_session", get_session)
+    monkeypatch.setattr(s2, "_backoff_time", lambda *args: 0)
+    return session
+
+
+def get_ID_with_data(s2):
+    """Return an ID whose data loads from the cache
+
+    """
+    for ID in sorted(s2._cache_backend.files):
+        if s2._check_cache(ID, quiet=True) is not None:
+            return ID
+    assert False
+
+
+def citation_pages_handler(num_served):
+    """Serve :code:`num_served` citations in pages with an ETag
+
+    """
+    def handler(method, url, kwargs):
+        if kwargs["headers"].get("If-None-Match") == "v1":
+            return 304, b""
+        args = dict(x.split("=") for x in url.split("?")[1].split("&"))
+        offset, limit = int(args["offset"]), int(args["limit"])
+        data = [{"contexts": [], "citingPaper": {"paperId": f"citing{i}", "title": f"Paper {i}",
+                                                 "citationCount": 0,
+                                                 "influentialCitationCount": 0,
+                                                 "authors": []}}
+                for i in range(offset, min(offset + limit, num_served))]
+        return 200, {"offset": offset, "next": offset + limit, "data": data}, {"ETag": "v1"}
+    return handler